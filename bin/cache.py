@@ -0,0 +1,55 @@
+import hashlib
+import os
+import yaml
+
+from util import *
+
+
+# A persistent store of run results in the problem tmpdir, used by `bt run --cached`.
+# Each result is stored in its own file named after its key: a hash of everything that influences
+# the result (see Run.cache_key). Hence concurrent runs never write to the same file.
+class ResultCache:
+    # The ExecResult members that are stored.
+    FIELDS = [
+        'ok', 'duration', 'err', 'out', 'verdict', 'print_verdict_', 'durations', 'memory',
+        'wall_time', 'exit_code', 'stderr', 'borderline'
+    ]
+
+    def __init__(self, problem):
+        self.dir = problem.tmpdir / 'results'
+
+    # Return a hex digest of the given parts, which must be str, bytes, or convertible with str().
+    @staticmethod
+    def key(*parts):
+        h = hashlib.sha256()
+        for part in parts:
+            if not isinstance(part, bytes): part = str(part).encode('utf-8')
+            # Prefix the length so that the parts can not run into each other.
+            h.update(str(len(part)).encode('utf-8') + b':' + part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return self.dir / key[:2] / (key + '.yaml')
+
+    # Return the stored ExecResult for key, or None.
+    def get(self, key):
+        path = self._path(key)
+        if not path.is_file(): return None
+        try:
+            data = yaml.safe_load(path.read_text())
+            result = ExecResult(None, None, None, None)
+            for field in ResultCache.FIELDS:
+                setattr(result, field, data.get(field))
+        except (yaml.YAMLError, AttributeError):
+            return None
+        result.cached = True
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {field: getattr(result, field) for field in ResultCache.FIELDS}
+        # Write to a temporary file first, so readers never see a partial result.
+        tmp_path = path.with_suffix(f'.{os.getpid()}.{threading.get_ident()}')
+        tmp_path.write_text(yaml.safe_dump(data))
+        tmp_path.replace(path)
@@ -0,0 +1,322 @@
+import os
+import platform
+import time
+
+import config
+import program
+
+from util import *
+
+# A trivial program for each language in config/languages.yaml, that reads and writes nothing.
+# Its duration is the time it takes to start (and stop) a program in that language.
+_TRIVIAL_PROGRAMS = {
+    'c': ('main.c', 'int main() { return 0; }\n'),
+    'cpp': ('main.cpp', 'int main() { return 0; }\n'),
+    'csharp': ('main.cs', 'class Program {\n    static void Main() {}\n}\n'),
+    'fsharp': ('main.fs', '[<EntryPoint>]\nlet main argv = 0\n'),
+    'go': ('main.go', 'package main\n\nfunc main() {}\n'),
+    'haskell': ('main.hs', 'main :: IO ()\nmain = return ()\n'),
+    'java':
+    ('Main.java', 'public class Main {\n    public static void main(String[] args) {}\n}\n'),
+    'javascript': ('main.js', '\n'),
+    'kotlin': ('main.kt', 'fun main() {}\n'),
+    'lisp': ('main.lisp', '\n'),
+    'ocaml': ('main.ml', '\n'),
+    'pascal': ('main.pas', 'begin\nend.\n'),
+    'php': ('main.php', '<?php\n'),
+    'pypy2_with_shebang': ('main.py', '#!/usr/bin/env pypy2\n'),
+    'pypy3': ('main.py', '\n'),
+    'pypy2': ('main.py2', '\n'),
+    'python2_with_shebang': ('main.py', '#!/usr/bin/env python2\n'),
+    'python3': ('main.py', '\n'),
+    'python2': ('main.py2', '\n'),
+    'ruby': ('main.rb', '\n'),
+    'rust': ('main.rs', 'fn main() {}\n'),
+    'scala': ('main.scala', 'object main extends App {}\n'),
+    'shell': ('main.sh', '\n'),
+    'bash': ('main.bash', '\n'),
+}
+
+# The benchmark suite of `bt calibrate`: C programs with a fixed amount of CPU-bound and
+# memory-bound work. The score of a machine is the sum of their durations.
+_BENCHMARK_PROGRAMS = {
+    'benchmark-cpu': ('main.c', r'''#include <stdio.h>
+
+int main() {
+    unsigned long long x = 88172645463325252ULL, sum = 0;
+    for (long i = 0; i < 100000000; i++) {
+        x ^= x << 13;
+        x ^= x >> 7;
+        x ^= x << 17;
+        sum += x % 1000003;
+    }
+    printf("%llu\n", sum);
+    return 0;
+}
+'''),
+    'benchmark-memory': ('main.c', r'''#include <stdio.h>
+#include <stdlib.h>
+
+#define N (1 << 22)
+
+int main() {
+    unsigned *next = malloc(N * sizeof(unsigned));
+    for (unsigned i = 0; i < N; i++) next[i] = i;
+    // Sattolo's algorithm: a random permutation that is a single cycle.
+    unsigned long long x = 88172645463325252ULL;
+    for (unsigned i = N - 1; i > 0; i--) {
+        x ^= x << 13;
+        x ^= x >> 7;
+        x ^= x << 17;
+        unsigned j = x % i, t = next[i];
+        next[i] = next[j];
+        next[j] = t;
+    }
+    unsigned p = 0;
+    for (long i = 0; i < 5000000; i++) p = next[p];
+    printf("%u\n", p);
+    free(next);
+    return 0;
+}
+'''),
+}
+
+# The key of the imported judge score in the calibration cache. Machine names can not start with _.
+_JUDGE = '_judge'
+
+# The startup times measured on this machine by language, the benchmark score of this machine and
+# of the judge, and the config.args they were read for.
+_startup = None
+_benchmark = None
+_judge = None
+_args = None
+
+
+class CalibrationProgram(program.Program):
+    subdir = 'calibration'
+
+
+# The calibration results of all machines that share this home directory, by machine name.
+def _path():
+    cache_root = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_root) / 'bapctools' / 'calibration.yaml'
+
+
+def _read():
+    path = _path()
+    if not path.is_file(): return dict()
+    try:
+        data = yaml.safe_load(path.read_text())
+    except yaml.YAMLError:
+        return dict()
+    return data if isinstance(data, dict) else dict()
+
+
+# Return the startup times of this machine by language. Startup times measured with a different
+# run command than the current one are dropped.
+def _machine():
+    global _startup, _benchmark, _judge, _args
+    if _args is not config.args:
+        data = _read()
+        machine = data.get(platform.node(), dict())
+        _args = config.args
+        languages = program.languages()
+        _startup = {
+            lang: entry
+            for lang, entry in machine.items()
+            if lang in languages and entry.get('run') == languages[lang]['run']
+        }
+        _benchmark = machine.get('benchmark')
+        _judge = data.get(_JUDGE)
+    return _startup
+
+
+def _write():
+    data = _read()
+    machine = dict(_machine())
+    if _benchmark is not None: machine['benchmark'] = _benchmark
+    data[platform.node()] = machine
+    if _judge is not None: data[_JUDGE] = _judge
+    path = _path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(yaml.safe_dump(data))
+
+
+# The startup time in seconds of a program in the given language on this machine, or None when it
+# was not calibrated.
+def startup(language):
+    entry = _machine().get(language)
+    return entry['startup'] if entry is not None else None
+
+
+# The duration of a run of a program in language minus its startup time, or None when the language
+# was not calibrated.
+def net_duration(language, duration):
+    s = startup(language)
+    if s is None: return None
+    return round(max(0.0, duration - s), 6)
+
+
+# The benchmark score of this machine and of the judge, in seconds, or None when they are unknown.
+def benchmark_score():
+    _machine()
+    return _benchmark['score'] if _benchmark is not None else None
+
+
+def judge_score():
+    _machine()
+    return _judge['score'] if _judge is not None else None
+
+
+# The estimated duration of a run on the judge, by scaling the local duration with the ratio of
+# the benchmark scores of the judge and this machine, or None when either score is unknown.
+def judge_duration(duration):
+    local, judge = benchmark_score(), judge_score()
+    if not local or judge is None: return None
+    return round(duration * judge / local, 6)
+
+
+# Build the program called name from the given source and return its minimal duration over runs
+# runs of its run command, or None on failure.
+def _measure(problem, name, language, filename, source, runs, bar):
+    source_dir = problem.tmpdir / 'calibration' / 'src' / name
+    source_dir.mkdir(parents=True, exist_ok=True)
+    source_path = source_dir / filename
+    # Only write the source when it changed, to not rebuild the program every time.
+    if not source_path.is_file() or source_path.read_text() != source:
+        source_path.write_text(source)
+
+    calibration = CalibrationProgram(problem, source_dir, skip_double_build_warning=True)
+    if not calibration.build(bar): return None
+    if calibration.language != language:
+        bar.log(f'Detected {calibration.language} instead. Skipping.')
+        return None
+
+    durations = []
+    for _ in range(runs):
+        with open(os.devnull, 'rb') as inf:
+            result = exec_command(calibration.run_command,
+                                  stdin=inf,
+                                  timeout=problem.settings.timeout,
+                                  memory=problem.settings.memory_limit,
+                                  watch_memory=True,
+                                  cwd=calibration.tmpdir)
+        if result.ok is not True:
+            bar.error('Failed', result.err)
+            return None
+        durations.append(result.duration)
+    return min(durations)
+
+
+# Measure the startup time of the given languages on this machine, using the run command from
+# languages.yaml, and store it in the calibration cache. The default is all languages with a trivial
+# program. Languages that were already calibrated are skipped, unless force is True.
+# Returns the languages that were measured.
+def calibrate_startup(problem, languages=None, *, force=False):
+    if languages is None: languages = list(_TRIVIAL_PROGRAMS)
+    available = program.languages()
+
+    # Skip languages of which the compiler or runtime is not installed.
+    def installed(language):
+        lang_config = available[language]
+        commands = [lang_config['run']]
+        if 'compile' in lang_config: commands.append(lang_config['compile'])
+        return all(c.split()[0][0] == '{' or shutil.which(c.split()[0]) for c in commands)
+
+    todo = []
+    for language in languages:
+        if language not in available:
+            error(f'Unknown language {language}.')
+        elif language not in _TRIVIAL_PROGRAMS:
+            # Custom languages from a contest languages.yaml can not be calibrated.
+            if force: warn(f'No trivial program to calibrate language {language}.')
+        elif (force or startup(language) is None) and installed(language):
+            todo.append(language)
+    if not todo: return []
+
+    bar = ProgressBar('Calibrate startup', items=todo)
+    measured = _machine()
+    done = []
+    for language in todo:
+        bar.start(language)
+        filename, source = _TRIVIAL_PROGRAMS[language]
+        duration = _measure(problem, language, language, filename, source, config.CALIBRATION_RUNS,
+                            bar)
+        if duration is None:
+            bar.done()
+            continue
+        measured[language] = {
+            'run': available[language]['run'],
+            'startup': round(duration, 4),
+            'time': time.strftime('%Y-%m-%d %H:%M'),
+        }
+        done.append(language)
+        bar.done(True, f'{duration:6.3f}s')
+    bar.finalize(print_done=False)
+
+    if done: _write()
+    return done
+
+
+# Run the benchmark suite config.BENCHMARK_RUNS times and store the sum of the minimal duration
+# of each benchmark as the score of this machine. Returns the score, or None on failure.
+def calibrate_benchmark(problem):
+    global _benchmark
+    _machine()
+    bar = ProgressBar('Benchmark', items=list(_BENCHMARK_PROGRAMS))
+    score = 0
+    for name, (filename, source) in _BENCHMARK_PROGRAMS.items():
+        bar.start(name)
+        duration = _measure(problem, name, 'c', filename, source, config.BENCHMARK_RUNS, bar)
+        if duration is None:
+            bar.done(False, 'Benchmark failed.')
+            bar.finalize(print_done=False)
+            return None
+        score += duration
+        bar.done(True, f'{duration:6.3f}s')
+    bar.finalize(print_done=False)
+
+    _benchmark = {'score': round(score, 4), 'time': time.strftime('%Y-%m-%d %H:%M')}
+    _write()
+    return _benchmark['score']
+
+
+# Store the benchmark score of the judge, measured with `bt calibrate` on the judge machine.
+def _import_judge_score(score):
+    global _judge
+    if score <= 0: fatal('The judge score must be positive.')
+    _machine()
+    _judge = {'score': score, 'time': time.strftime('%Y-%m-%d %H:%M')}
+    _write()
+
+
+# Measure the startup time of the --languages again, or of all languages that are installed, and
+# the benchmark score of this machine, or store the --judge-score. Then print the calibration of
+# this machine. See `bt calibrate`.
+def calibrate(problem):
+    if config.args.judge_score is not None:
+        _import_judge_score(config.args.judge_score)
+    else:
+        calibrate_startup(problem, config.args.languages or None, force=True)
+        if calibrate_benchmark(problem) is None: error('The benchmark could not be run.')
+
+    languages = program.languages()
+    measured = _machine()
+    if measured:
+        print(f'{cc.bold}Startup time on {platform.node()}{cc.reset} ({_path()})')
+        name_len = max(len(languages[lang]['name']) + len(lang) + 3 for lang in measured)
+        for lang, entry in sorted(measured.items(), key=lambda item: item[1]['startup']):
+            name = f'{languages[lang]["name"]} ({lang})'
+            print(f'  {name:<{name_len}}  {entry["startup"]:6.3f}s  measured {entry["time"]}')
+    elif config.args.judge_score is None:
+        error('No language could be calibrated.')
+        return False
+
+    print(f'{cc.bold}Benchmark score{cc.reset} (lower is faster)')
+    for name, entry in [(platform.node(), _benchmark), ('judge', _judge)]:
+        score = f'{entry["score"]:6.3f}s  measured {entry["time"]}' if entry else 'unknown'
+        print(f'  {name:<{max(len(platform.node()), 5)}}  {score}')
+    factor = judge_duration(1)
+    if factor is not None:
+        print(f'Durations on the judge are estimated as {factor:.3f} times the local durations.')
+    return True
@@ -16,6 +16,8 @@ PRIORITY = {
     'ACCEPTED': 0,
     'WRONG_ANSWER': 90,
     'TIME_LIMIT_EXCEEDED': 99,
+    'OUTPUT_LIMIT_EXCEEDED': 99,
+    'MEMORY_LIMIT_EXCEEDED': 99,
     'RUN_TIME_ERROR': 99,
 }
 
@@ -24,6 +26,28 @@ VALIDATION_MODES = ['default', 'custom', 'custom interactive']
 MAX_PRIORITY = max(PRIORITY.values())
 MAX_PRIORITY_VERDICT = [v for v in PRIORITY if PRIORITY[v] == MAX_PRIORITY]
 
+# With --fast-tle, submissions that are expected to time out are killed this many seconds after
+# the time limit.
+FAST_TLE_MARGIN = 0.1
+
+# With --jobs, the number of runs per job that are queued ahead of the run whose result is
+# printed next, see run.RunQueue.
+QUEUED_RUNS_PER_JOB = 1000
+
+# The number of times a run with a duration close to the time limit is measured again.
+BORDERLINE_RERUNS = 3
+
+# The number of runs of a trivial program to measure the startup time of a language.
+# The minimum duration is used.
+CALIBRATION_RUNS = 5
+# The default maximum size in MiB of the output and feedback files of runs of each problem, see
+# workspace.py.
+WORKSPACE_QUOTA = 1024
+# The number of runs of each benchmark of `bt calibrate`, of which the minimum is used.
+BENCHMARK_RUNS = 3
+# Net durations are only printed for languages with a startup time of at least this many seconds.
+NET_DURATION_THRESHOLD = 0.01
+
 # When --table is set, this threshold determines the number of identical profiles needed to get flagged.
 TABLE_THRESHOLD = 4
 
@@ -0,0 +1,105 @@
+import os
+import random
+
+import config
+import diffrun
+import parallel
+
+from util import *
+
+
+# The environment for the given run of a program. Except for the first run, glibc fills memory
+# returned by malloc and freed by free with a byte that depends on the run, so that reading
+# uninitialized heap memory likely gives a different output in each run.
+def perturbed_env(run_index):
+    env = dict(os.environ)
+    if run_index > 0: env['MALLOC_PERTURB_'] = str(1 + (run_index * 97 - 1) % 255)
+    return env
+
+
+# Describe how the runs of a submission on one testcase differ, or return None when they all have
+# the same exit code and output.
+def _difference(runs):
+    first_result, first_output = runs[0]
+    for i, (result, output) in enumerate(runs[1:], start=2):
+        if result.ok != first_result.ok:
+            return f'run 1 has exit code {first_result.ok}, run {i} has exit code {result.ok}'
+        block = first_output.first_difference(output)
+        if block is not None:
+            return f'runs 1 and {i} differ in ' + diffrun.describe_difference(
+                first_output, output, block)
+    return None
+
+
+# Run the --submissions, by default all accepted submissions, --runs times on each testcase and
+# check that each run writes the same output. See `bt deterministic`.
+# All runs go through one worker pool in random order, so that the repetitions of a run are
+# scheduled next to different other runs. Returns True when all submissions are deterministic.
+def deterministic(problem):
+    if problem.interactive:
+        fatal('deterministic does not work for interactive problems.')
+    if not config.args.submissions:
+        config.args.submissions = [Path('submissions') / 'accepted']
+    if config.args.runs < 2:
+        fatal('deterministic needs at least 2 --runs.')
+
+    submissions = problem.submissions()
+    if submissions is False: return False
+    submissions = [s for verdict in config.VERDICTS for s in submissions[verdict]]
+    testcases = problem.testcases()
+    if testcases is False: return False
+
+    # The results and OutputHashes of the runs of each submission, by testcase name.
+    outputs = {
+        submission: {
+            t.name: [None] * config.args.runs
+            for t in testcases
+        }
+        for submission in submissions
+    }
+
+    def task(item):
+        submission, testcase, i = item
+        outputs[submission][testcase.name][i] = diffrun.run_hashed(submission,
+                                                                   testcase.in_path,
+                                                                   env=perturbed_env(i))
+
+    tasks = [(s, t, i) for s in submissions for t in testcases for i in range(config.args.runs)]
+    random.Random(config.args.seed).shuffle(tasks)
+    pool = parallel.Parallel(task,
+                             max(1, config.args.jobs),
+                             pin=getattr(config.args, 'pin', False))
+    for item in tasks:
+        pool.put(item)
+
+    timeout = problem.settings.timeout
+    nondeterministic = []
+    for submission in submissions:
+        bar = ProgressBar(submission.name, items=testcases)
+        differences = 0
+        for testcase in testcases:
+            bar.start(testcase)
+            runs = outputs[submission][testcase.name]
+            pool.wait_until(lambda: all(run is not None for run in runs))
+            # The output of a run that was killed depends on when it was killed.
+            if any(result.duration >= timeout for result, _ in runs):
+                bar.done(message=f'{cc.orange}timeout, not compared{cc.reset}')
+                continue
+            difference = _difference(runs)
+            if difference is None:
+                bar.done()
+            else:
+                differences += 1
+                bar.done(False, difference)
+        bar.finalize(print_done=False)
+        if differences: nondeterministic.append((submission, differences))
+    pool.done()
+
+    if not nondeterministic:
+        print(f'{cc.green}All {len(submissions)} submissions wrote the same output in all '
+              f'{config.args.runs} runs on each of {len(testcases)} testcases.{cc.reset}')
+        return True
+    for submission, differences in nondeterministic:
+        print(f'{cc.red}{submission.name} is not deterministic on {differences} of '
+              f'{len(testcases)} testcases.{cc.reset}')
+    return False
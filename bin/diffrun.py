@@ -0,0 +1,142 @@
+import hashlib
+import os
+
+import config
+import parallel
+import run
+
+from util import *
+
+
+# The hashes of the output of a submission, computed while it is written.
+# The output is split into blocks of BLOCK_SIZE bytes, and for each block a hash and the line
+# number it starts on are stored. This locates the first difference between two outputs up to a
+# block without storing them.
+class OutputHash:
+    BLOCK_SIZE = 4096
+
+    def __init__(self):
+        self.blocks = []
+        self.lines = []
+        self.size = 0
+
+    # Read the pipe or file fd until it is closed.
+    def read(self, fd):
+        line = 1
+        with open(fd, 'rb') as f:
+            while True:
+                block = f.read(OutputHash.BLOCK_SIZE)
+                if not block: break
+                self.blocks.append(hashlib.blake2b(block, digest_size=8).digest())
+                self.lines.append(line)
+                line += block.count(b'\n')
+                self.size += len(block)
+
+    # Return the index of the first block where self and other differ, or None when they are equal.
+    def first_difference(self, other):
+        for i, (a, b) in enumerate(zip(self.blocks, other.blocks)):
+            if a != b: return i
+        if len(self.blocks) != len(other.blocks): return min(len(self.blocks), len(other.blocks))
+        return None
+
+    # The OutputHash of the file at path.
+    @staticmethod
+    def of_file(path):
+        output = OutputHash()
+        output.read(os.open(path, os.O_RDONLY))
+        return output
+
+
+# Run submission on in_path and return the ExecResult and the OutputHash of its stdout.
+# kwargs are passed on to Submission.run.
+def run_hashed(submission, in_path, **kwargs):
+    read_fd, write_fd = os.pipe()
+    output = OutputHash()
+    reader = threading.Thread(target=output.read, args=(read_fd, ), daemon=True)
+    reader.start()
+    with open(write_fd, 'wb') as out_file:
+        result = submission.run(in_path, None, out_file=out_file, **kwargs)
+    reader.join()
+    return result, output
+
+
+# Describe where the outputs a and b differ, given the index of the first block that differs.
+def describe_difference(a, b, block):
+    # Only the first block that differs is known, not the exact position in it.
+    longer = a if block < len(a.blocks) else b
+    start = block * OutputHash.BLOCK_SIZE
+    end = min(start + OutputHash.BLOCK_SIZE, max(a.size, b.size)) - 1
+    return f'bytes {start}-{end} (from line {longer.lines[block]}); sizes {a.size} and {b.size}'
+
+
+# Describe a failed run, or return None when the submission exited normally in time.
+def _failure(result, timeout):
+    if result.duration >= timeout: return 'timeout'
+    if result.ok is not True: return f'exit code {result.ok}'
+    return None
+
+
+# Run the two --submissions on all testcases in parallel and compare their outputs by hash,
+# without storing or validating them. See `bt diffrun`.
+# Returns True when all outputs are equal.
+def diffrun(problem):
+    if len(config.args.submissions) != 2:
+        fatal('diffrun needs exactly two submissions.')
+    if problem.interactive:
+        fatal('diffrun does not work for interactive problems.')
+
+    submissions = [run.Submission(problem, problem.path / s) for s in config.args.submissions]
+    bar = ProgressBar('Build submissions', items=submissions)
+    for s in submissions:
+        bar.start(s)
+        s.build(bar)
+        bar.done()
+    bar.finalize(print_done=False)
+    if not all(s.ok for s in submissions): return False
+
+    testcases = problem.testcases()
+    if testcases is False: return False
+
+    # The result and OutputHash of each submission, by testcase name.
+    outputs = [dict(), dict()]
+
+    def task(item):
+        i, testcase = item
+        outputs[i][testcase.name] = run_hashed(submissions[i], testcase.in_path)
+
+    pool = parallel.Parallel(task,
+                             max(1, config.args.jobs),
+                             pin=getattr(config.args, 'pin', False))
+    for testcase in testcases:
+        for i in range(2):
+            pool.put((i, testcase))
+
+    a, b = submissions
+    timeout = problem.settings.timeout
+    differences = 0
+    bar = ProgressBar(f'Compare {a.name} {b.name}', items=testcases)
+    for testcase in testcases:
+        bar.start(testcase)
+        pool.wait_until(lambda: all(testcase.name in o for o in outputs))
+        (result_a, output_a), (result_b, output_b) = (o[testcase.name] for o in outputs)
+        failures = [_failure(result_a, timeout), _failure(result_b, timeout)]
+        if any(failures):
+            differences += 1
+            bar.done(False, f'{a.name}: {failures[0] or "ok"}, {b.name}: {failures[1] or "ok"}')
+            continue
+        block = output_a.first_difference(output_b)
+        if block is None:
+            bar.done(True, f'{output_a.size} bytes equal')
+            continue
+        differences += 1
+        bar.done(False, 'outputs differ in ' + describe_difference(output_a, output_b, block))
+    pool.done()
+    bar.finalize(print_done=False)
+
+    if differences == 0:
+        print(f'{cc.green}The outputs of {a.name} and {b.name} are equal on all '
+              f'{len(testcases)} testcases.{cc.reset}')
+        return True
+    print(f'{cc.red}The outputs of {a.name} and {b.name} differ on {differences} of '
+          f'{len(testcases)} testcases.{cc.reset}')
+    return False
@@ -3,13 +3,13 @@ import random
 import re
 import shutil
 import yaml as yamllib
-import queue
-import threading
-import signal
 
 from pathlib import Path
 
 import config
+import deterministic
+import diffrun
+import parallel
 import program
 import validate
 import run
@@ -184,6 +184,9 @@ class SolutionInvocation(Invocation):
 
         if result.ok == -9:
             bar.error(f'solution TIMEOUT after {result.duration}s')
+        elif exceeds_output_limit(result, ans_path, self.program.problem.settings.output_limit):
+            output_limit = self.program.problem.settings.output_limit
+            bar.error(f'solution output exceeds the output limit of {output_limit} MiB')
         elif result.ok is not True:
             bar.error('Failed', result.err)
 
@@ -196,7 +199,7 @@ class SolutionInvocation(Invocation):
         interaction_path = cwd / (t.name + '.interaction')
         if interaction_path.is_file(): return True
 
-        testcase = run.Testcase(problem, in_path, short_path=t.path / t.name)
+        testcase = run.Testcase(problem, in_path, short_path=t.path / (t.name + '.in'))
         r = run.Run(problem, self.program, testcase)
 
         # No {name}/{seed} substitution is done since all IO should be via stdin/stdout.
@@ -385,11 +388,15 @@ class TestcaseRule(Rule):
         # use a deterministic generator by rerunning the generator with the
         # same arguments.  This is run when --check-deterministic is passed,
         # which is also set to True when running `bt all`.
-        # This doesn't do anything for manual cases.
-        def check_deterministic():
+        # The solution that generates the .ans file is rerun as well.
+        def check_deterministic(check_solution=True):
             if not getattr(config.args, 'check_deterministic', False):
                 return
 
+            check_generator_deterministic()
+            if check_solution: check_solution_deterministic()
+
+        def check_generator_deterministic():
             if t.manual:
                 return
 
@@ -409,6 +416,36 @@ class TestcaseRule(Rule):
             else:
                 bar.part_done(False, f'Generator is not deterministic.')
 
+        # Rerun the solution with perturbed heap memory, see `bt deterministic`, and compare the
+        # hash of its output to the .ans file.
+        def check_solution_deterministic():
+            if t.config.solution is None or problem.interactive:
+                return
+            # The .ans of a manual case that is not inline may be written by hand.
+            if t.manual and not t.manual_inline:
+                return
+            if not target_infile.is_file() or not target_ansfile.is_file():
+                return
+
+            solution = t.config.solution
+            result, output = diffrun.run_hashed(solution.program,
+                                                target_infile,
+                                                args=solution.args,
+                                                cwd=cwd,
+                                                env=deterministic.perturbed_env(1))
+            if result.ok is not True:
+                bar.part_done(False, f'Solution failed on rerun: exit code {result.ok}.')
+                return
+
+            expected = diffrun.OutputHash.of_file(target_ansfile)
+            block = expected.first_difference(output)
+            if block is None:
+                bar.part_done(True, 'Solution is deterministic.')
+            else:
+                bar.part_done(
+                    False, 'Solution is not deterministic: .ans and rerun differ in ' +
+                    diffrun.describe_difference(expected, output, block))
+
         # The expected contents of the meta_ file.
         def up_to_date():
             # The testcase is up to date if:
@@ -523,6 +560,7 @@ class TestcaseRule(Rule):
 
         skipped = False
         skipped_in = False
+        skipped_ans = False
         for ext in config.KNOWN_DATA_EXTENSIONS:
             source = cwd / (t.name + ext)
             target = target_dir / (t.name + ext)
@@ -539,6 +577,8 @@ class TestcaseRule(Rule):
                             skipped = True
                             if ext == '.in':
                                 skipped_in = True
+                            if ext == '.ans':
+                                skipped_ans = True
                             continue
                         bar.log(f'CHANGED {target.name}')
                 else:
@@ -584,8 +624,9 @@ class TestcaseRule(Rule):
             yaml.dump(t.cache_data, meta_path.open('w'))
 
         # If the .in was changed but not overwritten, check_deterministic will surely fail.
+        # The same holds for the solution when the .ans was not overwritten.
         if not skipped_in:
-            check_deterministic()
+            check_deterministic(check_solution=not skipped_ans)
         bar.done()
 
     def clean(t, problem, generator_config, bar):
@@ -1103,16 +1144,16 @@ class GeneratorConfig:
 
         bar = ProgressBar('Generate', items=item_names)
 
-        parallel = True
+        run_parallel = True
         if self.parallel and config.args.jobs > 1 and self.problem.interactive:
-            parallel = False
+            run_parallel = False
             log('Disabling parallelization for interactive problem.')
 
         if not self.parallel or config.args.jobs <= 1:
-            parallel = False
+            run_parallel = False
             log('Disabling parallelization.')
 
-        if not parallel:
+        if not run_parallel:
             self.root_dir.walk(
                 lambda t: t.generate(self.problem, self, bar),
                 lambda d: d.generate(self.problem, self, bar),
@@ -1122,73 +1163,20 @@ class GeneratorConfig:
             # All testcases are generated in separate threads. Directories are still handled by the
             # main thread. We only start processing a directory after all preceding test cases have
             # completed to avoid problems with including cases.
-            q = queue.Queue()
-            error = None
-
-            # TODO: Make this a generators.yaml option?
-            num_worker_threads = config.args.jobs
-
-            def clear_queue(e=True):
-                nonlocal num_worker_threads, error
-                if error is not None: return
-                error = e
-                try:
-                    while True:
-                        q.get(block=False)
-                        q.task_done()
-                except queue.Empty:
-                    pass
-                for _ in range(num_worker_threads):
-                    q.put(None)
-                    q.task_done()
-
-            def worker():
-                try:
-                    while True:
-                        testcase = q.get()
-                        if testcase is None: break
-                        testcase.generate(self.problem, self, bar)
-                        q.task_done()
-                except Exception as e:
-                    q.task_done()
-                    clear_queue(e)
-
-            threads = []
-            for _ in range(num_worker_threads):
-                t = threading.Thread(target=worker)
-                t.start()
-                threads.append(t)
-
-            def interrupt_handler(sig, frame):
-                clear_queue()
-                fatal('Running interrupted')
-
-            signal.signal(signal.SIGINT, interrupt_handler)
-
-            def maybe_join():
-                if error is not None:
-                    raise error
-                q.join()
+            pool = parallel.Parallel(lambda t: t.generate(self.problem, self, bar),
+                                     config.args.jobs,
+                                     pin=getattr(config.args, 'pin', False))
 
             def generate_dir(d):
-                maybe_join()
+                pool.join()
                 d.generate(self.problem, self, bar)
 
             self.root_dir.walk(
-                q.put,
+                pool.put,
                 generate_dir,
             )
 
-            maybe_join()
-
-            for _ in range(num_worker_threads):
-                q.put(None)
-
-            for t in threads:
-                t.join()
-
-            if error is not None:
-                raise error
+            pool.done()
 
         bar.finalize()
 
@@ -0,0 +1,202 @@
+import platform
+import sqlite3
+import statistics
+import time
+
+import config
+
+from util import *
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS invocations (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    git_commit TEXT,
+    machine TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS runs (
+    invocation INTEGER NOT NULL REFERENCES invocations(id),
+    problem TEXT NOT NULL,
+    submission TEXT NOT NULL,
+    submission_hash TEXT NOT NULL,
+    testcase TEXT NOT NULL,
+    testcase_hash TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    duration REAL NOT NULL,
+    memory INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_by_testcase ON runs (problem, submission, testcase);
+'''
+
+# Open databases and the id of the current invocation in each of them, by path.
+# They are reset for each new config.args, i.e. each invocation of BAPCtools.
+_databases = {}
+_args = None
+
+
+def _path(problem):
+    return getattr(config.args, 'history_db', None) or problem.tmpdir / 'history.sqlite'
+
+
+def _connect(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(path))
+    connection.executescript(_SCHEMA)
+    return connection
+
+
+def _git_commit(problem):
+    result = exec_command(['git', 'rev-parse', 'HEAD'], cwd=problem.path, crop=False)
+    return result.out.strip() if result.ok is True and result.out else None
+
+
+# Return the connection and current invocation id for the database of problem.
+def _database(problem):
+    global _databases, _args
+    if _args is not config.args:
+        for connection, _ in _databases.values():
+            connection.close()
+        _databases = {}
+        _args = config.args
+    path = _path(problem)
+    if path not in _databases:
+        connection = _connect(path)
+        with connection:
+            invocation = connection.execute(
+                'INSERT INTO invocations (time, git_commit, machine) VALUES (?, ?, ?)',
+                (time.time(), _git_commit(problem), platform.node())).lastrowid
+        _databases[path] = (connection, invocation)
+    return _databases[path]
+
+
+# Append the results of the given runs of submission to the history database.
+# Results replayed from the ResultCache are skipped, since they were recorded when they ran.
+def record(submission, runs):
+    runs = [run for run in runs if run.result is not None and not run.result.cached]
+    if not runs: return
+    problem = submission.problem
+    connection, invocation = _database(problem)
+    submission_hash = submission.hash()
+    with connection:
+        connection.executemany(
+            'INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(invocation, problem.name, str(
+                submission.short_path), submission_hash, run.testcase.name, run.testcase.hash(),
+              run.result.verdict, run.result.duration, run.result.memory) for run in runs])
+
+
+# Print the timing history of the submissions of problem, see `bt history`:
+# - per submission, the maximum and total duration in its most recent invocations,
+# - the testcases that became more than --threshold percent slower than in the previous
+#   invocation on the same machine,
+# - the --slowest testcases, relative to the median duration of each submission.
+def show(problem):
+    path = _path(problem)
+    if not path.is_file():
+        warn(f'No run history found at {path}.')
+        return True
+    connection = _connect(path)
+
+    # Submissions are stored by their path relative to submissions/.
+    submissions = [
+        str(s.relative_to('submissions') if s.parts[:1] == ('submissions', ) else s)
+        for s in getattr(config.args, 'submissions', None) or []
+    ]
+    query = '''SELECT invocations.id, invocations.time, invocations.git_commit,
+                      invocations.machine, runs.submission, runs.testcase, runs.verdict,
+                      runs.duration
+               FROM runs JOIN invocations ON runs.invocation = invocations.id
+               WHERE runs.problem = ? ORDER BY invocations.id'''
+    rows = [
+        row for row in connection.execute(query, (problem.name, ))
+        if not submissions or any(row[4] == s or row[4].startswith(s + '/') for s in submissions)
+    ]
+    connection.close()
+    if not rows:
+        warn(f'No runs of {problem.name} found in {path}.')
+        return True
+
+    # submission -> invocation -> testcase -> (verdict, duration)
+    durations = dict()
+    invocations = dict()
+    for invocation, started, commit, machine, submission, testcase, verdict, duration in rows:
+        invocations[invocation] = (started, commit, machine)
+        by_invocation = durations.setdefault(submission, dict())
+        by_invocation.setdefault(invocation, dict())[testcase] = (verdict, duration)
+
+    _print_trends(durations, invocations)
+    _print_regressions(durations, invocations)
+    _print_slowest(durations)
+    return True
+
+
+def _print_trends(durations, invocations):
+    last = config.args.last
+    print(f'{cc.bold}Max / total duration in the last {last} invocations{cc.reset}')
+    name_len = max(len(s) for s in durations)
+    for submission, by_invocation in sorted(durations.items()):
+        columns = []
+        for invocation in sorted(by_invocation)[-last:]:
+            times = [duration for _, duration in by_invocation[invocation].values()]
+            started, commit, _ = invocations[invocation]
+            # Label invocations by commit, or by date outside git.
+            label = commit[:7] if commit else time.strftime('%m-%d %H:%M', time.localtime(started))
+            columns.append(f'{label} {max(times):6.3f}s /{sum(times):7.3f}s')
+        print(f'{submission:<{name_len}}  ' + '  '.join(columns))
+
+
+def _print_regressions(durations, invocations):
+    threshold = config.args.threshold
+    regressions = []
+    for submission, by_invocation in sorted(durations.items()):
+        order = sorted(by_invocation)
+        latest = order[-1]
+        machine = invocations[latest][2]
+        for testcase, (verdict, duration) in sorted(by_invocation[latest].items()):
+            # The previous invocation on the same machine that ran this testcase.
+            previous = [
+                i for i in order[:-1]
+                if invocations[i][2] == machine and testcase in by_invocation[i]
+            ]
+            if not previous: continue
+            _, old = by_invocation[previous[-1]][testcase]
+            # Ignore differences below the resolution of the measurements.
+            if duration - old < 0.01: continue
+            if duration > old * (1 + threshold / 100):
+                regressions.append((submission, testcase, old, duration))
+
+    print(f'\n{cc.bold}Testcases more than {threshold:g}% slower than in the previous '
+          f'invocation on the same machine{cc.reset}')
+    if not regressions:
+        print('None.')
+        return
+    name_len = max(len(s) + len(t) for s, t, _, _ in regressions) + 1
+    for submission, testcase, old, new in regressions:
+        name = f'{submission} {testcase}'
+        print(f'{name:<{name_len}}  {old:6.3f}s -> {cc.orange}{new:6.3f}s{cc.reset}'
+              f' (+{(new / old - 1) * 100 if old > 0 else float("inf"):.0f}%)')
+
+
+def _print_slowest(durations):
+    # For each testcase, its duration relative to the median duration of the accepted testcases
+    # of each submission, in the latest invocation of each submission that accepted it.
+    relative = dict()
+    for submission, by_invocation in durations.items():
+        latest = by_invocation[max(by_invocation)]
+        accepted = {t: d for t, (v, d) in latest.items() if v == 'ACCEPTED'}
+        if not accepted: continue
+        median = statistics.median(accepted.values())
+        if median <= 0: continue
+        for testcase, duration in accepted.items():
+            relative.setdefault(testcase, []).append(duration / median)
+
+    print(f'\n{cc.bold}Slowest testcases, relative to the median accepted testcase of each '
+          f'submission{cc.reset}')
+    if not relative:
+        print('None.')
+        return
+    slowest = sorted(relative.items(), key=lambda item: -statistics.mean(item[1]))
+    name_len = max(len(t) for t, _ in slowest[:config.args.slowest])
+    for testcase, ratios in slowest[:config.args.slowest]:
+        print(f'{testcase:<{name_len}}  {statistics.mean(ratios):5.2f}x median'
+              f' (max {max(ratios):.2f}x over {len(ratios)} submissions)')
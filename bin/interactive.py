@@ -34,9 +34,9 @@ def run_interactive_testcase(
     # Set limits
     validator_timeout = 60
 
-    memory_limit = get_memory_limit()
+    memory_limit = run.problem.settings.memory_limit
     timelimit = run.problem.settings.timelimit
-    timeout = run.problem.settings.timeout
+    timeout = run.submission.timeout()
 
     # Validator command
     validator_command = output_validator.run_command + [
@@ -103,7 +103,7 @@ def run_interactive_testcase(
             verdict = 'VALIDATOR_CRASH'
         elif did_timeout:
             verdict = 'TIME_LIMIT_EXCEEDED'
-            if tend - tstart >= timeout:
+            if tend - tstart >= run.problem.settings.timeout:
                 print_verdict = 'TLE (aborted)'
         elif ok is not True:
             verdict = 'RUN_TIME_ERROR'
@@ -203,6 +203,7 @@ while True:
                                   preexec_fn=limit_setter(submission_command, timeout,
                                                           memory_limit))
     submission_pid = submission.pid
+    watchdog = MemoryWatchdog(submission) if MemoryWatchdog.supported() else None
 
     os.close(team_out)
     os.close(val_out)
@@ -214,21 +215,23 @@ while True:
     validator_status = None
     submission_status = None
     submission_time = None
+    submission_memory = None
     first = None
 
     def kill_submission(signal, frame):
         nonlocal submission_time
         submission_time = timeout
-        submission.kill()
-        validator.kill()
+        # Popen.kill() may reap the processes, after which wait3 below would not find them.
+        kill_process(submission)
+        kill_process(validator)
         if interaction:
-            team_tee.kill()
-            val_tee.kill()
+            kill_process(team_tee)
+            kill_process(val_tee)
 
     signal.signal(signal.SIGALRM, kill_submission)
 
-    # Raise alarm after timeout reached
-    signal.alarm(timeout)
+    # Raise alarm after timeout reached. The timeout is fractional with --fast-tle.
+    signal.setitimer(signal.ITIMER_REAL, timeout)
 
     # Wait for first to finish
     for i in range(4 if interaction else 2):
@@ -240,16 +243,17 @@ while True:
             validator_status = status
             # Kill the team submission in case we already know it's WA.
             if i == 0 and validator_status != config.RTV_AC:
-                submission.kill()
+                kill_process(submission)
             continue
 
         if pid == submission_pid:
-            signal.alarm(0)
+            signal.setitimer(signal.ITIMER_REAL, 0)
             if first is None: first = 'submission'
             submission_status = status
             # Possibly already written by the alarm.
             if not submission_time:
                 submission_time = rusage.ru_utime + rusage.ru_stime
+            if watchdog is not None: submission_memory = watchdog.stop()
             continue
 
         if pid == team_tee_pid: continue
@@ -278,7 +282,10 @@ while True:
     print_verdict = None
     if aborted:
         verdict = 'TIME_LIMIT_EXCEEDED'
-        print_verdict = 'TLE (aborted)'
+        # Like other runs, runs killed early by --fast-tle are not labelled as aborted.
+        if submission_time >= run.problem.settings.timeout: print_verdict = 'TLE (aborted)'
+    elif memory_limit and submission_memory and submission_memory > memory_limit * 1024 * 1024:
+        verdict = 'MEMORY_LIMIT_EXCEEDED'
     elif validator_status != config.RTV_AC and validator_status != config.RTV_WA:
         config.n_error += 1
         verdict = 'VALIDATOR_CRASH'
@@ -316,4 +323,6 @@ while True:
     elif team_error is not None:
         team_err = submission.stderr.read().decode('utf-8')
 
-    return ExecResult(True, submission_time, val_err, team_err, verdict, print_verdict)
+    result = ExecResult(True, submission_time, val_err, team_err, verdict, print_verdict)
+    result.memory = submission_memory
+    return result
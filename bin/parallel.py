@@ -0,0 +1,153 @@
+import heapq
+import os
+import threading
+
+import config
+from util import *
+
+
+# Split the cores of this process into the cores that worker threads may be pinned to and a quiet
+# core for --borderline measurements. The first --reserve-cores cores are left free for BAPCtools
+# itself. When borderline runs are measured again, the last core is kept off the worker list.
+# Returns (None, None) when pinning is not possible.
+def _split_cores():
+    cores = sorted(os.sched_getaffinity(0))
+    reserve = getattr(config.args, 'reserve_cores', 1) or 0
+    if reserve >= len(cores): return None, None
+    cores = cores[reserve:]
+    if getattr(config.args, 'borderline', None) and len(cores) >= 2:
+        return cores[:-1], cores[-1]
+    return cores, None
+
+
+# Return the sorted list of cores that worker threads may be pinned to, see _split_cores().
+# Returns None when pinning is not possible.
+def available_cores():
+    if not hasattr(os, 'sched_setaffinity'):
+        warn('Pinning jobs to cores is not supported on this platform.')
+        return None
+    cores, _ = _split_cores()
+    if cores is None:
+        reserve = getattr(config.args, 'reserve_cores', 1) or 0
+        warn(f'Can not reserve {reserve} of {len(os.sched_getaffinity(0))} cores. '
+             'Not pinning jobs to cores.')
+    return cores
+
+
+# Return a core that no pinned worker thread and not BAPCtools itself uses, or None when there is
+# none. Such a core only exists when jobs are pinned (--pin) and --borderline is given.
+def quiet_core():
+    if not getattr(config.args, 'pin', False) or not hasattr(os, 'sched_setaffinity'):
+        return None
+    return _split_cores()[1]
+
+
+# A pool of worker threads that run f(task) for every task put on its queue.
+# Tasks with a lower priority value are started first. Ties are started in insertion order.
+# Tasks can be put in a group, so that the pending tasks of that group can be dropped by cancel().
+#
+# When pin is True, each worker thread owns one core from available_cores() and all processes
+# it starts via exec_command are pinned to that core. The number of threads is capped to the
+# number of available cores.
+#
+# The worker threads are daemons, so an interrupted main thread never hangs on them.
+# The first exception raised by a task drops all pending tasks and is re-raised in the main thread
+# by wait_until(), join() and done().
+class Parallel:
+    def __init__(self, f, num_threads, pin=False):
+        assert num_threads >= 1
+        self.f = f
+
+        cores = available_cores() if pin else None
+        if cores is not None and num_threads > len(cores):
+            log(f'Using {len(cores)} instead of {num_threads} jobs to pin each job to its own core.'
+                )
+            num_threads = len(cores)
+        self.num_threads = num_threads
+
+        self.mutex = threading.Lock()
+        # Notified when a task is added or the pool is shutting down.
+        self.todo = threading.Condition(self.mutex)
+        # Notified whenever a task finishes.
+        self.finished = threading.Condition(self.mutex)
+
+        # A min-heap of (priority, id, group, task) tuples. The id makes sure groups and tasks are
+        # never compared.
+        self.tasks = []
+        self.next_id = 0
+        self.running = 0
+        self.first_error = None
+        self.stopping = False
+
+        self.threads = []
+        for i in range(num_threads):
+            core = cores[i] if cores is not None else None
+            t = threading.Thread(target=self._worker, args=(core, ), daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self, core):
+        pin_thread(core)
+        while True:
+            with self.mutex:
+                while not self.tasks and not self.stopping:
+                    self.todo.wait()
+                if not self.tasks: return
+                _, _, _, task = heapq.heappop(self.tasks)
+                self.running += 1
+
+            error = None
+            try:
+                self.f(task)
+            # fatal() raises SystemExit, which must reach the main thread as well.
+            except BaseException as e:
+                error = e
+
+            with self.mutex:
+                if error is not None and self.first_error is None:
+                    self.first_error = error
+                    self.tasks = []
+                self.running -= 1
+                self.finished.notify_all()
+
+    def put(self, task, priority=0, group=None):
+        with self.mutex:
+            heapq.heappush(self.tasks, (priority, self.next_id, group, task))
+            self.next_id += 1
+            self.todo.notify()
+
+    # Block until predicate() holds. The predicate is evaluated while holding the queue lock, and
+    # is re-evaluated each time a task finishes.
+    def wait_until(self, predicate):
+        with self.mutex:
+            while not predicate():
+                if self.first_error is not None: raise self.first_error
+                self.finished.wait()
+
+    # Wait until all tasks that were put so far have finished.
+    def join(self):
+        self.wait_until(lambda: len(self.tasks) == 0 and self.running == 0)
+        if self.first_error is not None: raise self.first_error
+
+    # Drop the tasks of group that have not been started yet. Tasks of the group that are running
+    # are not interrupted.
+    def cancel(self, group):
+        with self.mutex:
+            self.tasks = [t for t in self.tasks if t[2] is not group]
+            heapq.heapify(self.tasks)
+            # Waiters may wait for the queue to become empty.
+            self.finished.notify_all()
+
+    # Drop all tasks that have not been started yet.
+    def stop(self):
+        with self.mutex:
+            self.tasks = []
+
+    # Finish all remaining tasks and shut down the worker threads.
+    def done(self):
+        with self.mutex:
+            self.stopping = True
+            self.todo.notify_all()
+        for t in self.threads:
+            t.join()
+        if self.first_error is not None: raise self.first_error
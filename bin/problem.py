@@ -2,13 +2,20 @@ import re
 import glob
 import argparse
 import hashlib
+import json
+import random
+import os
 
 from pathlib import Path
 
+import cache
+import calibrate
 import config
+import parallel
 import program
 import run
 import validate
+import workspace
 import shlex
 from util import *
 
@@ -24,6 +31,8 @@ class Problem:
         # The Path of the problem directory.
         self.path = path
         self.tmpdir = tmpdir / self.name
+        # The directory where runs write their files, see workspace.py.
+        self.workspace = workspace.root(tmpdir) / self.name
         # Read problem.yaml and domjudge-problem.ini into self.settings Namespace object.
         self._read_settings()
 
@@ -34,6 +43,8 @@ class Problem:
         self._programs = dict()
         self._program_callbacks = dict()
         self._rules_cache = dict()
+        self._on_reject = dict()
+        self.result_cache = cache.ResultCache(self)
 
         # The label for the problem: A, B, A1, A2, X, ...
         if label is None:
@@ -93,6 +104,17 @@ class Problem:
             pass
         self.settings.timeout = int(timeout)
 
+        # The output limit in MiB, from limits.output in problem.yaml. The default is that of the
+        # problem package format.
+        limits = getattr(self.settings, 'limits', None)
+        if not isinstance(limits, dict): limits = {}
+        self.settings.output_limit = getattr(config.args, 'output_limit', None) or limits.get(
+            'output', 8)
+        # The memory limit for submissions in MiB, from limits.memory in problem.yaml, or None for
+        # no limit. --memory overrides it.
+        if getattr(config.args, 'memory', None): self.settings.memory_limit = get_memory_limit()
+        else: self.settings.memory_limit = limits.get('memory', get_memory_limit())
+
         if self.settings.validation not in config.VALIDATION_MODES:
             fatal(
                 f'Unrecognised validation mode {self.settings.validation}. Must be one of {", ".join(config.VALIDATION_MODES)}'
@@ -142,16 +164,23 @@ class Problem:
             if include_bad:
                 in_paths += list(glob(p.path, 'data/bad/**/*.in'))
 
+        # List the .ans files of each directory once, instead of checking each testcase separately.
+        ans_names = dict()
+        if needans:
+            for d in {str(f.parent) for f in in_paths}:
+                ans_names[d] = {e.name for e in os.scandir(d) if e.name.endswith('.ans')}
+
         testcases = []
         for f in in_paths:
             t = run.Testcase(p, f)
             # Require both in and ans files
-            if needans and not t.ans_path.is_file():
+            if needans and f.stem + '.ans' not in ans_names[str(f.parent)]:
                 if not t.bad_input:
                     warn(f'Found input file {str(f)} without a .ans file. Skipping.')
                 continue
             testcases.append(t)
         testcases.sort(key=lambda t: t.name)
+        if getattr(config.args, 'quick', None): testcases = p._quick_testcases(testcases)
 
         if len(testcases) == 0:
             warn(f'Didn\'t find any testcases{" with answer" if needans else ""} for {p.name}')
@@ -160,6 +189,44 @@ class Problem:
         p._testcases[key] = testcases
         return testcases
 
+    # With --quick K, keep all samples and at most K testcases of each directory in data/secret.
+    # Testcases are preferred in this order:
+    # - testcases that failed submissions in their previous run, by their score in the --table:
+    #   each submission that failed adds 1 / the number of testcases it failed,
+    # - the other testcases, largest input first. Testcases with inputs of the same size are in a
+    #   random order that only depends on --seed and the directory.
+    def _quick_testcases(problem, testcases):
+        scores = dict()
+        for path in (problem.workspace / 'runs').rglob('.history.json'):
+            try:
+                previous = json.loads(path.read_text())
+            except ValueError:
+                continue
+            if not isinstance(previous, dict): continue
+            failed = [name for name, h in previous.items() if h.get('verdict') != 'ACCEPTED']
+            for name in failed:
+                scores[name] = scores.get(name, 0) + 1 / len(failed)
+
+        groups = dict()
+        for t in testcases:
+            if t.short_path.parts[0] == 'secret':
+                groups.setdefault(t.short_path.parent, []).append(t)
+
+        selected = [t for t in testcases if t.short_path.parts[0] != 'secret']
+        for group, group_testcases in groups.items():
+            discriminating = sorted([t for t in group_testcases if t.name in scores],
+                                    key=lambda t: (-scores[t.name], t.name))
+            rest = [t for t in group_testcases if t.name not in scores]
+            # Shuffle before the stable sort to break ties by size randomly.
+            random.Random(f'{config.args.seed} {group}').shuffle(rest)
+            rest.sort(key=lambda t: -t.in_path.stat().st_size)
+            order = discriminating + rest
+            selected += order[:config.args.quick]
+
+        log(f'Quick run on {len(selected)} of {len(testcases)} testcases (seed {config.args.seed}).'
+            )
+        return sorted(selected, key=lambda t: t.name)
+
     # returns a map {expected verdict -> [(name, command)]}
     def submissions(problem):
         if problem._submissions is not None: return problem._submissions
@@ -321,6 +388,24 @@ class Problem:
         problem._validators[key] = validators
         return validators
 
+    # The on_reject setting for data/<directory>, 'break' or 'continue', from the testdata.yaml in
+    # that directory or else in its closest ancestor below data/. Defaults to 'break'.
+    def on_reject(problem, directory):
+        if directory not in problem._on_reject:
+            data = problem.path / 'data'
+            path = data / directory
+            while path != data and not (path / 'testdata.yaml').is_file():
+                path = path.parent
+            settings = read_yaml(path / 'testdata.yaml')
+            on_reject = settings.get('on_reject', 'break') if isinstance(settings,
+                                                                         dict) else 'break'
+            if on_reject not in ['break', 'continue']:
+                where = (path / 'testdata.yaml').relative_to(problem.path)
+                warn(f'Unknown on_reject: {on_reject} in {where}. Using break.')
+                on_reject = 'break'
+            problem._on_reject[directory] = on_reject
+        return problem._on_reject[directory]
+
     def run_submissions(problem):
         needans = False if problem.interactive else True
         testcases = problem.testcases(needans=needans)
@@ -341,22 +426,68 @@ class Problem:
         if problem.validators('output') is False:
             return False
 
+        if getattr(config.args, 'table_only', False):
+            return problem._print_stored_table(testcases, submissions)
+
+        # Measure the startup time of languages that were not calibrated on this machine yet, so
+        # that net durations can be reported. This must happen before any run is started.
+        calibrate.calibrate_startup(
+            problem, sorted({s.language
+                             for verdict in submissions
+                             for s in submissions[verdict]}))
+
+        # Runs for all submissions are queued on a single worker pool, in the order they are
+        # printed, a bounded number ahead of the results that were printed. Results are collected
+        # per submission, so output stays grouped.
+        # Interactive runs use SIGALRM and wait3, which only work on the main thread.
+        pool = None
+        queue = None
+        if config.args.jobs > 1:
+            if problem.interactive:
+                log('Disabling parallelization for interactive problem.')
+            else:
+                pool = parallel.Parallel(lambda task: task(),
+                                         config.args.jobs,
+                                         pin=getattr(config.args, 'pin', False))
+                queue = run.RunQueue(pool,
+                                     [s for verdict in submissions for s in submissions[verdict]],
+                                     config.QUEUED_RUNS_PER_JOB * pool.num_threads)
+
         ok = True
         verdict_table = []
+        # The results of each submission by testcase name, for --minimal-testset.
+        result_table = []
         # When true, the ProgressBar will print a newline before the first error log.
         needs_leading_newline = False if config.args.verbose else True
         for verdict in submissions:
             for submission in submissions[verdict]:
                 d = dict()
                 verdict_table.append(d)
+                results = dict()
+                result_table.append((submission, results))
                 submission_ok, printed_newline = submission.run_all_testcases(
-                    max_submission_len, table_dict=d, needs_leading_newline=needs_leading_newline)
+                    max_submission_len,
+                    table_dict=d,
+                    table_results=results,
+                    needs_leading_newline=needs_leading_newline,
+                    queue=queue,
+                    pool=pool)
                 needs_leading_newline = not printed_newline
                 ok &= submission_ok
 
+        if pool is not None:
+            # Lazy judging already cancelled the remaining runs of each submission it stopped.
+            pool.stop()
+            pool.done()
+
+        Problem._print_borderline(submissions)
+
         if hasattr(config.args, 'table') and config.args.table:
             Problem._print_table(verdict_table, testcases, submissions)
+        if getattr(config.args, 'minimal_testset', False):
+            Problem._print_minimal_testset(result_table, testcases)
 
+        workspace.evict(problem)
         return ok
 
     # Takes a list of submissions and runs them against the chosen testcases.
@@ -376,6 +507,124 @@ class Problem:
                     submission.test()
         return True
 
+    # Print the --table from the results in the ResultCache only, without running anything.
+    # Cells without a stored result are shown as '-'.
+    def _print_stored_table(problem, testcases, submissions):
+        verdict_table = []
+        result_table = []
+        missing = 0
+        print('Stored results of:')
+        for verdict in submissions:
+            for submission in submissions[verdict]:
+                print(f'  {submission.name}')
+                d = dict()
+                verdict_table.append(d)
+                results = dict()
+                result_table.append((submission, results))
+                for testcase in submission.ordered_testcases():
+                    r = run.Run(problem, submission, testcase)
+                    result = problem.result_cache.get(r.cache_key())
+                    if result is None:
+                        missing += 1
+                        continue
+                    d[r.name] = result.verdict == 'ACCEPTED'
+                    results[r.name] = result
+        if missing > 0:
+            total = len(verdict_table) * len(testcases)
+            warn(f'{missing} of {total} runs have no stored result. Run bt run --table first.')
+        Problem._print_table(verdict_table, testcases, submissions)
+        if getattr(config.args, 'minimal_testset', False):
+            Problem._print_minimal_testset(result_table, testcases)
+        return True
+
+    # List the runs that were measured again because their duration was close to the time limit,
+    # with how much the new measurements vary.
+    @staticmethod
+    def _print_borderline(submissions):
+        borderline_runs = [(submission, r)
+                           for verdict in submissions
+                           for submission in submissions[verdict]
+                           for r in submission.borderline_runs]
+        if not borderline_runs: return
+
+        print(f'\nBorderline runs, measured {config.BORDERLINE_RERUNS} more times:')
+        name_len = max(len(submission.name) + len(r.name) for submission, r in borderline_runs)
+        for submission, r in borderline_runs:
+            result = r.result
+            name = f'{submission.name} {r.name}'
+            spread = result.durations[-1] - result.durations[0]
+            print(f'{name:<{name_len + 1}}  first {result.borderline:6.3f}s  '
+                  f'again {result.durations[0]:6.3f}s - {result.durations[-1]:6.3f}s '
+                  f'(spread {spread:.3f}s)  {result.print_verdict()}')
+
+    # Return a small set of testcase names that still fails every submission that is not expected
+    # to be accepted, and the number of such submissions that fail on some testcase.
+    # With keep_slowest, the slowest testcase of each accepted submission is kept as well.
+    # Finding the smallest such set is NP-hard, so testcases are chosen greedily: the testcase that
+    # fails most remaining submissions first, then the fastest one, then by name.
+    # result_table is a list of (submission, {testcase name: ExecResult}) pairs, and cost maps each
+    # testcase name to its total duration over all submissions.
+    @staticmethod
+    def _minimal_testset(result_table, cost, keep_slowest):
+        # The testcases that fail each submission that should fail.
+        failing = dict()
+        for submission, results in result_table:
+            if submission.expected_verdicts[0] == 'ACCEPTED': continue
+            names = {name for name, result in results.items() if result.verdict != 'ACCEPTED'}
+            if not names:
+                warn(f'No testcase fails {submission.name}.')
+                continue
+            failing[submission] = names
+
+        selected = []
+        remaining = dict(failing)
+        while remaining:
+            counts = dict()
+            for names in remaining.values():
+                for name in names:
+                    counts[name] = counts.get(name, 0) + 1
+            best = min(counts, key=lambda name: (-counts[name], cost[name], name))
+            selected.append(best)
+            remaining = {s: names for s, names in remaining.items() if best not in names}
+
+        if keep_slowest:
+            for submission, results in result_table:
+                if submission.expected_verdicts[0] != 'ACCEPTED': continue
+                accepted = {n: r.duration for n, r in results.items() if r.verdict == 'ACCEPTED'}
+                if not accepted: continue
+                slowest = max(accepted, key=lambda name: (accepted[name], name))
+                if slowest not in selected: selected.append(slowest)
+
+        return sorted(selected), len(failing)
+
+    # Print the set of testcases found by _minimal_testset, as paths that can be passed to `bt run`.
+    # Finally, the slowest testcases that are not in the set are listed, since they are redundant.
+    @staticmethod
+    def _print_minimal_testset(result_table, testcases):
+        # The total duration of each testcase over all submissions.
+        cost = {t.name: 0 for t in testcases}
+        for _, results in result_table:
+            for name, result in results.items():
+                cost[name] += result.duration
+
+        keep_slowest = getattr(config.args, 'keep_slowest', False)
+        selected, failing = Problem._minimal_testset(result_table, cost, keep_slowest)
+        print(
+            f'\nMinimal testset: {len(selected)} of {len(testcases)} testcases fail all '
+            f'{failing} submissions that should fail',
+            end='')
+        print(', with the slowest testcase of each AC submission.' if keep_slowest else '.')
+        # All other output goes to stderr with --minimal-testset, see tools.run_parsed_arguments.
+        for name in selected:
+            print(Path('data') / name, file=sys.__stdout__)
+
+        redundant = sorted((t.name for t in testcases if t.name not in selected),
+                           key=lambda name: (-cost[name], name))
+        if redundant:
+            print('\nSlowest redundant testcases, by total duration over all submissions:')
+            for name in redundant[:10]:
+                print(f'{name:<60} {cost[name]:6.3f}s')
+
     @staticmethod
     def _print_table(verdict_table, testcases, submission):
         # Begin by aggregating bitstrings for all testcases, and find bitstrings occurring often (>=config.TABLE_THRESHOLD).
@@ -1,3 +1,4 @@
+import hashlib
 import re
 import shutil
 import stat
@@ -126,6 +127,7 @@ class Program:
 
         self.ok = True
         self.built = False
+        self._hash = None
 
         # Detect language, dependencies, and main file
         if deps:
@@ -349,6 +351,19 @@ class Program:
                 c(self)
         return True
 
+    # Return a hash of the run command and all files in the build directory, identifying this
+    # build of the program. Only valid after a successful build(). Computed only once.
+    def hash(self):
+        if self._hash is not None: return self._hash
+        assert self.run_command is not None
+        h = hashlib.sha256(' '.join(self.run_command).encode('utf-8'))
+        for f in sorted(self.tmpdir.rglob('*')):
+            if f.name == 'meta_' or '__pycache__' in f.parts or not f.is_file(): continue
+            h.update(str(f.relative_to(self.tmpdir)).encode('utf-8'))
+            h.update(f.read_bytes())
+        self._hash = h.hexdigest()
+        return self._hash
+
     @staticmethod
     def add_callback(problem, path, c):
         if path not in problem._program_callbacks: problem._program_callbacks[path] = []
@@ -0,0 +1,78 @@
+import json
+import re
+import threading
+
+import calibrate
+import config
+
+from util import *
+
+# The open --report file, and the config.args it was opened for.
+_file = None
+_args = None
+# Runs are written by the worker threads that finish them.
+_lock = threading.Lock()
+
+_ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def _plain(text):
+    return _ANSI_ESCAPE.sub('', text) if text is not None else None
+
+
+# Append one JSON record to the --report file and flush it, so that readers can follow the report
+# while bt is running. The file is truncated on the first record of each invocation.
+def _write(record):
+    global _file, _args
+    path = getattr(config.args, 'report', None)
+    if path is None: return
+    with _lock:
+        if _args is not config.args:
+            if _file is not None: _file.close()
+            _file = open(path, 'w')
+            _args = config.args
+        _file.write(json.dumps(record) + '\n')
+        _file.flush()
+
+
+# Write the record of a finished run of submission, as soon as it finishes. net_cpu_time is the cpu_time minus the startup
+# time of the language, or null when it was not calibrated. judge_cpu_time is the cpu_time
+# estimated on the judge, or null when the benchmark scores are unknown, see `bt calibrate`.
+def write_run(submission, run):
+    result = run.result
+    _write({
+        'type': 'run',
+        'problem': submission.problem.name,
+        'submission': str(submission.short_path),
+        'testcase': str(run.name),
+        'verdict': result.verdict,
+        'expected_verdicts': submission.expected_verdicts,
+        'cpu_time': result.duration,
+        'net_cpu_time': calibrate.net_duration(submission.language, result.duration),
+        'judge_cpu_time': calibrate.judge_duration(result.duration),
+        'wall_time': result.wall_time,
+        'memory': result.memory,
+        'exit_code': result.exit_code,
+        'stderr': _plain(result.stderr),
+        'message': _plain(result.err),
+        'cached': result.cached,
+    })
+
+
+# Write the summary record of a submission, given the results of its judged runs.
+# startup_time is the calibrated startup time of its language, see `bt calibrate`.
+def write_submission(submission, results, verdict_run):
+    memory = [result.memory for result in results if result.memory is not None]
+    _write({
+        'type': 'submission',
+        'problem': submission.problem.name,
+        'submission': str(submission.short_path),
+        'verdict': submission.verdict,
+        'expected_verdicts': submission.expected_verdicts,
+        'ok': submission.verdict in submission.expected_verdicts,
+        'testcase': str(verdict_run.name) if verdict_run is not None else None,
+        'runs': len(results),
+        'max_cpu_time': max((result.duration for result in results), default=None),
+        'max_memory': max(memory, default=None),
+        'startup_time': calibrate.startup(submission.language),
+    })
@@ -1,52 +1,110 @@
+import functools
+import hashlib
 import program
 import config
 import validate
 import interactive
+import cache
+import calibrate
+import collections
+import parallel
+import report
+import history
 import os
+import shutil
+import statistics
+import threading
+import json
 
 from util import *
 
 
+# Lazy judging: stop running a submission on the first max priority verdict, unless every testcase
+# must be shown (-v) or run (--table).
+def lazy_judging():
+    return not config.args.verbose and not getattr(config.args, 'table', False)
+
+
+# Problems can have 100k testcases, so a Testcase only stores its paths and name. Attributes that
+# need syscalls are computed when they are used.
 class Testcase:
+    __slots__ = ['problem', 'in_path', 'short_path', 'name', '_hash', '_included']
+
     def __init__(self, problem, path, *, short_path=None):
         assert path.suffix == '.in'
 
         self.problem = problem
 
         self.in_path = path
-        self.ans_path = self.in_path.with_suffix('.ans')
-        # Note: testcases outside problem/data must pass in the short_path explicitly.
+        # Note: testcases outside problem/data must pass in the short_path explicitly, including
+        # the .in suffix.
         if short_path is None:
             try:
                 self.short_path = path.relative_to(problem.path / 'data')
             except ValueError:
                 fatal(f"Testcase {path} is not inside {problem.path / 'data'}.")
         else:
-            assert short_path is not None
+            assert short_path.suffix == '.in'
             self.short_path = short_path
 
-        # Display name: everything after data/.
-        self.name = str(self.short_path.with_suffix(''))
-
-        bad = self.short_path.parts[0] == 'bad'
-        self.bad_input = bad and not self.ans_path.is_file()
-        self.bad_output = bad and self.ans_path.is_file()
-
-        self.sample = self.short_path.parts[0] == 'sample'
-
-        self.included = False
-        if path.is_symlink():
-            include_target = Path(os.path.normpath(path.parent / os.readlink(path)))
+        # Display name: everything after data/, without the .in.
+        self.name = str(self.short_path)[:-len('.in')]
+
+        self._hash = None
+        self._included = None
+
+    @property
+    def ans_path(self):
+        return self.in_path.with_suffix('.ans')
+
+    @property
+    def bad_input(self):
+        return self.short_path.parts[0] == 'bad' and not self.ans_path.is_file()
+
+    @property
+    def bad_output(self):
+        return self.short_path.parts[0] == 'bad' and self.ans_path.is_file()
+
+    @property
+    def sample(self):
+        return self.short_path.parts[0] == 'sample'
+
+    # The test group of the testcase: its directory below data/secret, like secret/group1.
+    # None for samples and testcases directly in data/secret.
+    @property
+    def test_group(self):
+        parts = self.short_path.parts
+        return str(self.short_path.parent) if parts[0] == 'secret' and len(parts) > 2 else None
+
+    # Whether the .in is a symlink to another testcase in data/. Computed only once.
+    @property
+    def included(self):
+        if self._included is not None: return self._included
+        self._included = False
+        if self.in_path.is_symlink():
+            include_target = Path(os.path.normpath(
+                self.in_path.parent / os.readlink(self.in_path)))
             try:
-                include_target.relative_to(problem.path / 'data')
-                self.included = True
+                include_target.relative_to(self.problem.path / 'data')
+                self._included = True
             except ValueError:
                 # The case is a manual cases included from generators/.
                 pass
+        return self._included
 
     def with_suffix(self, ext):
         return self.in_path.with_suffix(ext)
 
+    # Return a hash of the contents of the .in and .ans files. Computed only once.
+    def hash(self):
+        if self._hash is not None: return self._hash
+        h = hashlib.sha256()
+        for path in [self.in_path, self.ans_path]:
+            data = path.read_bytes() if path.is_file() else b''
+            h.update(str(len(data)).encode('utf-8') + b':' + data)
+        self._hash = h.hexdigest()
+        return self._hash
+
     # Validate the testcase input/output format. validator_type must be 'input_format' or 'output_format'.
     def validate_format(self, validator_type, *, bar, constraints=None):
         assert validator_type in ['input_format', 'output_format']
@@ -119,28 +177,208 @@ class Testcase:
         return success
 
 
+# A Run is created for each testcase when it is queued, possibly long before it is executed, so
+# its paths are computed and its directory is created only when it is executed.
 class Run:
-    def __init__(self, problem, submission, testcase):
+    __slots__ = [
+        'problem', 'submission', 'testcase', 'name', 'result', '_repeat', '_lock', '_measurements',
+        '_results', '_cache_checked'
+    ]
+
+    # Borderline runs are measured again one at a time, see _remeasure_borderline().
+    _borderline_lock = threading.Lock()
+
+    # repeat > 0 is used for the additional measurements of --repeat. They store their output
+    # next to the output of the first measurement.
+    def __init__(self, problem, submission, testcase, *, repeat=0):
         self.problem = problem
         self.submission = submission
         self.testcase = testcase
         self.name = self.testcase.name
         self.result = None
+        self._repeat = repeat
+
+        # Only used when the measurements are executed as separate tasks, see tasks().
+        self._lock = None
+        self._measurements = None
+        self._results = None
+        self._cache_checked = False
+
+    def _tmp_path(self):
+        tmp_path = self.problem.workspace / 'runs' / self.submission.short_path / self.testcase.short_path
+        if self._repeat > 0: tmp_path = tmp_path.with_suffix(f'.{self._repeat}.in')
+        return tmp_path
+
+    @property
+    def out_path(self):
+        return self._tmp_path().with_suffix('.out')
+
+    @property
+    def feedbackdir(self):
+        return self._tmp_path().with_suffix('.feedbackdir')
 
-        tmp_path = self.problem.tmpdir / 'runs' / self.submission.short_path / self.testcase.short_path
-        self.out_path = tmp_path.with_suffix('.out')
-        self.feedbackdir = tmp_path.with_suffix('.feedbackdir')
+    # Create the feedback directory, and with it the directory of out_path.
+    def make_dirs(self):
         self.feedbackdir.mkdir(exist_ok=True, parents=True)
 
-    # Return an ExecResult object amended with verdict.
+    # Return a hash of everything that influences the result of this run: the built submission,
+    # the testcase, the output validators, the validator flags, the limits, --repeat and
+    # --borderline. With --fast-tle, the timeout may differ per submission.
+    def cache_key(self):
+        output_validators = self.problem.validators('output')
+        settings = self.problem.settings
+        return cache.ResultCache.key(
+            self.submission.hash(), self.testcase.hash(),
+            *[v.hash() for v in output_validators], settings.validator_flags, settings.timelimit,
+            self.submission.timeout(), settings.memory_limit, settings.output_limit,
+            getattr(config.args, 'repeat', None) or 1, getattr(config.args, 'repeat_stat', None),
+            getattr(config.args, 'borderline', None))
+
+    # With --repeat N, the submission is executed N times and the results are combined.
+    def _new_measurements(self):
+        repeat = getattr(config.args, 'repeat', None) or 1
+        return [self] + [
+            Run(self.problem, self.submission, self.testcase, repeat=i) for i in range(1, repeat)
+        ]
+
+    # Return the tasks to put on a worker pool for this run, one for each measurement.
+    # self.result is set once all of them have finished.
+    def tasks(self):
+        self._measurements = self._new_measurements()
+        if len(self._measurements) == 1: return [self.run]
+        self._lock = threading.Lock()
+        self._results = [None] * len(self._measurements)
+        return [functools.partial(self._measure, i) for i in range(len(self._measurements))]
+
+    def _measure(self, i):
+        if getattr(config.args, 'cached', False):
+            # Only the first task to start does the lookup. On a hit, all tasks return directly.
+            with self._lock:
+                if not self._cache_checked:
+                    self._cache_checked = True
+                    result = self.problem.result_cache.get(self.cache_key())
+                    if result is not None: self._finish(result, False)
+            if self.result is not None: return
+
+        result = self._measurements[i]._execute()
+        # The submission was cancelled, so its result is not needed anymore.
+        if result is None: return
+        with self._lock:
+            self._results[i] = result
+            if not all(r is not None for r in self._results): return
+        # Only the task that completes the last measurement gets here.
+        result = self._remeasure_borderline(Run._combine(self._results))
+        if result is None: return
+        self._finish(result, getattr(config.args, 'cached', False))
+
+    # Return an ExecResult object amended with verdict, or None when the submission was cancelled.
+    # With --cached, results are looked up in and stored to the problem's ResultCache.
     def run(self, *, interaction=None, submission_args=None):
+        use_cache = getattr(config.args, 'cached',
+                            False) and interaction is None and submission_args is None
+        if use_cache:
+            result = self.problem.result_cache.get(self.cache_key())
+            if result is not None:
+                self._finish(result, False)
+                return result
+
+        if interaction is not None or submission_args is not None:
+            result = self._execute(interaction=interaction, submission_args=submission_args)
+        else:
+            results = [m._execute() for m in self._new_measurements()]
+            if None in results: return None
+            result = self._remeasure_borderline(Run._combine(results))
+            if result is None: return None
+
+        self._finish(result, use_cache)
+        return result
+
+    # Store the result of this run. It is written to the --report as soon as the run finishes, on
+    # the worker thread that finished it, so that it is not lost when bt is interrupted.
+    def _finish(self, result, use_cache):
+        # Validator crashes are not results of the submission and should be retried.
+        if use_cache and result.verdict != 'VALIDATOR_CRASH':
+            self.problem.result_cache.put(self.cache_key(), result)
+        self.result = result
+        report.write_run(self.submission, self)
+
+    # Whether the duration of the result is within the --borderline band around the time limit, so
+    # that the verdict may depend on the load of the machine. Runs that were killed at the timeout
+    # are never borderline, which matters for --fast-tle, where the timeout is in the band.
+    def _is_borderline(self, result):
+        band = getattr(config.args, 'borderline', None)
+        if not band or result.verdict not in ['ACCEPTED', 'TIME_LIMIT_EXCEEDED']: return False
+        if result.duration >= self.submission.timeout(): return False
+        timelimit = self.problem.settings.timelimit
+        return abs(result.duration - timelimit) <= band * timelimit
+
+    # Measure a borderline run config.BORDERLINE_RERUNS more times and return the combined result
+    # of the new measurements. Only one borderline run is measured at a time, on a quiet core when
+    # there is one, while the other jobs continue on their own cores.
+    def _remeasure_borderline(self, result):
+        if not self._is_borderline(result): return result
+        measurements = [
+            Run(self.problem, self.submission, self.testcase, repeat=i)
+            for i in range(1, config.BORDERLINE_RERUNS + 1)
+        ]
+        with Run._borderline_lock:
+            core = pinned_core()
+            pin_thread(parallel.quiet_core())
+            try:
+                results = [m._execute() for m in measurements]
+            finally:
+                pin_thread(core)
+        if None in results: return None
+        new_result = Run._combine(results)
+        new_result.borderline = result.duration
+        return new_result
+
+    # Combine the results of repeated measurements into one, see --repeat and --repeat-stat.
+    # A failure that does not depend on timing is reported even when only one measurement has it.
+    # Otherwise, the measurement whose duration is the chosen statistic determines the verdict.
+    @staticmethod
+    def _combine(results):
+        if len(results) == 1: return results[0]
+        failures = [r for r in results if r.verdict not in ['ACCEPTED', 'TIME_LIMIT_EXCEEDED']]
+        if failures:
+            result = max(failures, key=lambda r: config.PRIORITY[r.verdict])
+        else:
+            ordered = sorted(results, key=lambda r: r.duration)
+            index = {'min': 0, 'median': (len(ordered) - 1) // 2, 'max': -1}
+            result = ordered[index[getattr(config.args, 'repeat_stat', None) or 'median']]
+        result.durations = sorted(r.duration for r in results)
+        return result
+
+    # Execute the submission once and return the ExecResult amended with verdict.
+    # Returns None when the submission was cancelled before or while it ran, see Submission.cancel.
+    def _execute(self, *, interaction=None, submission_args=None):
         if self.problem.interactive:
+            self.make_dirs()
             result = interactive.run_interactive_testcase(self,
                                                           interaction=interaction,
                                                           submission_args=submission_args)
         else:
-            result = self.submission.run(self.testcase.in_path, self.out_path)
-            if result.duration > self.problem.settings.timelimit:
+            if self.submission.cancelled() or self.submission.skips(self.testcase): return None
+            self.make_dirs()
+            validator_result = None
+            if self._pipelined():
+                result, validator_result = self.submission.run_pipelined(
+                    self,
+                    self.problem.validators('output')[0])
+            else:
+                result = self.submission.run(self.testcase.in_path, self.out_path)
+            # The result of a killed submission is meaningless.
+            if self.submission.cancelled(): return None
+            exit_code = 0 if result.ok is True else result.ok
+            stderr = result.err
+            if exceeds_output_limit(result, self.out_path, self.problem.settings.output_limit):
+                # The submission was killed when its output reached the output limit.
+                result.verdict = 'OUTPUT_LIMIT_EXCEEDED'
+                result.err = f'Output exceeds {self.problem.settings.output_limit} MiB'
+            elif self._exceeds_memory_limit(result):
+                result.verdict = 'MEMORY_LIMIT_EXCEEDED'
+                result.err = f'Memory exceeds {self.problem.settings.memory_limit} MiB'
+            elif result.duration > self.problem.settings.timelimit:
                 result.verdict = 'TIME_LIMIT_EXCEEDED'
                 if result.duration >= self.problem.settings.timeout:
                     result.print_verdict_ = 'TLE (aborted)'
@@ -151,10 +389,14 @@ class Run:
                 else:
                     result.err = 'Exited with code ' + str(result.ok)
             else:
-                # Overwrite the result with validator returncode and stdout/stderr, but keep the original duration.
-                duration = result.duration
-                result = self._validate_output()
-                result.duration = duration
+                # Overwrite the result with validator returncode and stdout/stderr, but keep the
+                # measurements of the submission.
+                execution = result
+                result = self._validate_output(validator_result)
+                result.duration = execution.duration
+                result.wall_time = execution.wall_time
+                result.core = execution.core
+                result.memory = execution.memory
 
                 if result.ok is True:
                     result.verdict = 'ACCEPTED'
@@ -163,22 +405,41 @@ class Run:
                 else:
                     config.n_error += 1
                     result.verdict = 'VALIDATOR_CRASH'
+            result.exit_code = exit_code
+            result.stderr = stderr
 
-            # Delete .out files larger than 1MB.
-            if not config.args.error and self.out_path.is_file(
-            ) and self.out_path.stat().st_size > 1000000000:
+            # Only keep the .out of failing runs. Without -e, also delete .out files larger than 1MB.
+            if self.out_path.is_file() and (result.verdict == 'ACCEPTED' or
+                                            (not config.args.error
+                                             and self.out_path.stat().st_size > 1000000)):
                 self.out_path.unlink()
 
-        self.result = result
         return result
 
-    def _validate_output(self):
+    # Whether the peak resident memory of the result is over the memory limit. The MemoryWatchdog
+    # usually kills such runs early, but a short peak between two of its samples only shows in the
+    # high water mark it reads afterwards.
+    def _exceeds_memory_limit(self, result):
+        memory_limit = self.problem.settings.memory_limit
+        return memory_limit and result.memory and result.memory > memory_limit * 1024 * 1024
+
+    # With --pipe, the output is streamed into the output validator (see _pipelined), and the
+    # validator already ran. This requires a single output validator that is not a format validator.
+    def _pipelined(self):
+        if not getattr(config.args, 'pipe', False): return False
+        output_validators = self.problem.validators('output')
+        return len(output_validators) == 1 and output_validators[
+            0].language not in validate.Validator.FORMAT_VALIDATOR_LANGUAGES
+
+    # validator_result is the result of the output validator when it already ran with --pipe.
+    def _validate_output(self, validator_result=None):
         output_validators = self.problem.validators('output')
         if output_validators is False: return False
 
         last_result = None
         for output_validator in output_validators:
-            ret = output_validator.run(self.testcase, self)
+            if validator_result is not None: ret = validator_result
+            else: ret = output_validator.run(self.testcase, self)
 
             judgemessage = self.feedbackdir / 'judgemessage.txt'
             judgeerror = self.feedbackdir / 'judgeerror.txt'
@@ -206,6 +467,53 @@ class Run:
         return last_result
 
 
+# Creates the runs of the given submissions when they are queued on pool, in the order in which
+# their results are collected with next(). At most window runs are queued ahead of the collected
+# ones, so that the memory used grows with the number of executed runs instead of with the number
+# of submissions times testcases. The remaining runs of cancelled submissions are never created.
+# Only used from the main thread.
+class RunQueue:
+    def __init__(self, pool, submissions, window):
+        self._pool = pool
+        self._window = window
+        self._submissions = collections.deque(submissions)
+        self._testcases = None
+        self._queued = {submission: collections.deque() for submission in submissions}
+        self._outstanding = 0
+        self._fill()
+
+    # Queue runs until window runs are outstanding or all runs are queued.
+    def _fill(self):
+        while self._outstanding < self._window and self._submissions:
+            submission = self._submissions[0]
+            if self._testcases is None: self._testcases = iter(submission.ordered_testcases())
+            testcase = None if submission.cancelled() else next(self._testcases, None)
+            if testcase is None:
+                self._submissions.popleft()
+                self._testcases = None
+                continue
+            run = Run(submission.problem, submission, testcase)
+            self._queued[submission].append(run)
+            self._outstanding += 1
+            for task in run.tasks():
+                self._pool.put(task, group=submission)
+
+    # The next run of submission, which is queued on the pool and may still be running.
+    # The runs of earlier submissions must all have been collected or dropped, so that the runs of
+    # submission are the first ones in the window.
+    def next(self, submission):
+        run = self._queued[submission].popleft()
+        self._outstanding -= 1
+        self._fill()
+        return run
+
+    # Forget the runs of submission that were not collected, because it was cancelled.
+    def drop(self, submission):
+        self._outstanding -= len(self._queued[submission])
+        self._queued[submission].clear()
+        self._fill()
+
+
 class Submission(program.Program):
     subdir = 'submissions'
 
@@ -214,10 +522,26 @@ class Submission(program.Program):
 
         self.verdict = None
         self.duration = None
+        # The duration minus the startup time of the language, when it was calibrated.
+        self.net_duration = None
+        # The runs that were measured again because their duration was close to the time limit.
+        self.borderline_runs = []
 
         # The first element will match the directory the file is in, if possible.
         self.expected_verdicts = self._get_expected_verdicts()
 
+        # Kills the running processes of this submission, see cancel().
+        self._cancellation = Cancellation()
+        # The test groups in which a testcase was rejected, see run_all_testcases.
+        self._rejected_groups = set()
+        # The history of this submission, loaded once by _read_history.
+        self._history = None
+
+        # Pool of scratch working directories for runs of this submission. See _acquire_cwd.
+        self._cwd_lock = threading.Lock()
+        self._free_cwds = []
+        self._num_cwds = 0
+
     def _get_expected_verdicts(self):
         verdicts = []
 
@@ -281,52 +605,239 @@ class Submission(program.Program):
             verdicts = ['ACCEPTED']
         return verdicts
 
+    # Return a scratch working directory that no other run of this submission is using.
+    # It contains symlinks to all files in the build directory, so it looks like self.tmpdir to the
+    # submission, but anything the submission writes stays private to this run.
+    # Directories are only created when more runs happen concurrently than before, and are
+    # recycled via _release_cwd afterwards.
+    def _acquire_cwd(self):
+        with self._cwd_lock:
+            if self._free_cwds: return self._free_cwds.pop()
+            cwd = self.problem.workspace / 'runs' / self.short_path / '.cwd' / str(self._num_cwds)
+            self._num_cwds += 1
+
+        if cwd.is_dir(): shutil.rmtree(cwd)
+        cwd.mkdir(parents=True)
+        for f in self.tmpdir.iterdir():
+            if f.name == 'meta_': continue
+            (cwd / f.name).symlink_to(f.resolve())
+        return cwd
+
+    # Remove everything the run wrote to cwd and put it back in the pool.
+    def _release_cwd(self, cwd):
+        for f in cwd.iterdir():
+            if f.is_symlink(): continue
+            if f.is_dir():
+                shutil.rmtree(f)
+            else:
+                f.unlink()
+        # Restore symlinks the submission removed.
+        for f in self.tmpdir.iterdir():
+            if f.name == 'meta_': continue
+            if not (cwd / f.name).is_symlink():
+                (cwd / f.name).symlink_to(f.resolve())
+        with self._cwd_lock:
+            self._free_cwds.append(cwd)
+
+    # Stop all runs of this submission, because its verdict is known: the runs that are queued on
+    # pool are dropped, and running processes are killed. Runs that were cancelled get no result.
+    def cancel(self, pool):
+        pool.cancel(self)
+        self._cancellation.cancel()
+
+    def cancelled(self):
+        return self._cancellation.cancelled
+
+    # Whether the remaining testcases of the test group of testcase are skipped, because another
+    # testcase of the group was rejected.
+    def skips(self, testcase):
+        return testcase.test_group in self._rejected_groups
+
+    # The timeout of runs of this submission. With --fast-tle and lazy judging, submissions that are
+    # expected to exceed the time limit are killed config.FAST_TLE_MARGIN seconds after it instead,
+    # since their verdict is TIME_LIMIT_EXCEEDED either way.
+    def timeout(self):
+        settings = self.problem.settings
+        if (getattr(config.args, 'fast_tle', False) and lazy_judging()
+                and 'TIME_LIMIT_EXCEEDED' in self.expected_verdicts):
+            return min(settings.timeout, settings.timelimit + config.FAST_TLE_MARGIN)
+        return settings.timeout
+
     # Run submission on in_path, writing stdout to out_path or stdout if out_path is None.
+    # Instead of out_path, an open binary file can be passed as out_file.
+    # env is the environment of the submission. The default is that of BAPCtools.
     # args is used by SubmissionInvocation to pass on additional arguments.
+    # When cwd is None, the submission runs in a private scratch directory, so that multiple runs
+    # of the same submission can happen concurrently.
     # Returns ExecResult
-    def run(self, in_path, out_path, crop=True, args=[], cwd=None):
+    def run(self, in_path, out_path, crop=True, args=[], cwd=None, out_file=None, env=None):
         assert self.run_command is not None
-        # Just for safety reasons, change the cwd.
-        if cwd is None: cwd = self.tmpdir
-        with in_path.open('rb') as inf:
-            out_file = out_path.open('wb') if out_path else None
-
-            # Print stderr to terminal is stdout is None, otherwise return its value.
-            result = exec_command(self.run_command + args,
-                                  crop=crop,
-                                  stdin=inf,
-                                  stdout=out_file,
-                                  stderr=None if out_file is None else True,
-                                  timeout=self.problem.settings.timeout,
-                                  cwd=cwd)
-            if out_file: out_file.close()
-            return result
+        scratch_cwd = None
+        if cwd is None: cwd = scratch_cwd = self._acquire_cwd()
+        try:
+            with in_path.open('rb') as inf:
+                close_out_file = out_file is None and out_path is not None
+                if close_out_file: out_file = out_path.open('wb')
+
+                # Print stderr to terminal is stdout is None, otherwise return its value.
+                result = exec_command(self.run_command + args,
+                                      crop=crop,
+                                      stdin=inf,
+                                      stdout=out_file,
+                                      stderr=None if out_file is None else True,
+                                      timeout=self.timeout(),
+                                      output_limit=self.problem.settings.output_limit,
+                                      memory=self.problem.settings.memory_limit,
+                                      watch_memory=True,
+                                      cancellation=self._cancellation,
+                                      env=env,
+                                      cwd=cwd)
+                if close_out_file: out_file.close()
+                return result
+        finally:
+            if scratch_cwd is not None: self._release_cwd(scratch_cwd)
+
+    # Run submission on the testcase of run, streaming stdout into the given output validator.
+    # The output is also written to the out_path of run, so that it can be kept when the run fails.
+    # Once the validator rejected the output, the rest of it is only written with -e.
+    # Returns the ExecResults of the submission and of the validator, see exec_pipeline.
+    def run_pipelined(self, run, output_validator):
+        assert self.run_command is not None
+        cwd = self._acquire_cwd()
+        try:
+            with run.testcase.in_path.open('rb') as inf:
+                return exec_pipeline(self.run_command,
+                                     output_validator.team_output_command(run.testcase, run),
+                                     stdin=inf,
+                                     cwd=cwd,
+                                     validator_cwd=run.feedbackdir,
+                                     timeout=self.timeout(),
+                                     validator_expect=config.RTV_AC,
+                                     tee=run.out_path,
+                                     tee_rest=config.args.error,
+                                     output_limit=self.problem.settings.output_limit,
+                                     memory=self.problem.settings.memory_limit,
+                                     cancellation=self._cancellation)
+        finally:
+            self._release_cwd(cwd)
+
+    # Return the testcases of the current problem in the order in which they are run.
+    # With lazy judging, the testcases are ordered using the results of the previous run of this
+    # submission, so that failing submissions usually stop after one or two runs:
+    # - first the testcases that failed, most severe verdict and then slowest first,
+    # - then testcases without history, by name,
+    # - then testcases that were accepted, slowest first.
+    def ordered_testcases(self):
+        testcases = self.problem.testcases()
+        if lazy_judging():
+            previous = self._read_history()
+
+            def order(testcase):
+                h = previous.get(testcase.name)
+                if h is None: return (1, 0, 0, testcase.name)
+                if h['verdict'] != 'ACCEPTED':
+                    return (0, -config.PRIORITY.get(h['verdict'], 0), -h['duration'],
+                            testcase.name)
+                return (2, 0, -h['duration'], testcase.name)
+
+            testcases = sorted(testcases, key=order)
+        return testcases
+
+    # The verdict and duration of the last run on each testcase, used to order testcases.
+    # This is JSON, since a YAML file with 100k testcases takes seconds to parse and dump.
+    def _history_path(self):
+        return self.problem.workspace / 'runs' / self.short_path / '.history.json'
+
+    def _read_history(self):
+        if self._history is not None: return self._history
+        self._history = dict()
+        path = self._history_path()
+        if path.is_file():
+            try:
+                previous = json.loads(path.read_text())
+            except ValueError:
+                previous = None
+            if isinstance(previous, dict): self._history = previous
+        return self._history
+
+    def _write_history(self, runs):
+        history = self._read_history()
+        for run in runs:
+            if run.result is None: continue
+            history[run.testcase.name] = {
+                'verdict': run.result.verdict,
+                'duration': run.result.duration
+            }
+        path = self._history_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(history))
 
     # Run this submission on all testcases for the current problem.
+    # When queue is given, the runs are queued on its pool and their results are only collected
+    # here, in testcase order.
+    # table_dict and table_results are filled with whether each testcase was accepted, and with its
+    # result, respectively.
     # Returns (OK verdict, printed newline)
     def run_all_testcases(self,
                           max_submission_name_len=None,
                           table_dict=None,
                           *,
-                          needs_leading_newline):
-        runs = [Run(self.problem, self, testcase) for testcase in self.problem.testcases()]
-        max_item_len = max(len(run.name)
-                           for run in runs) + max_submission_name_len - len(self.name)
+                          table_results=None,
+                          needs_leading_newline,
+                          queue=None,
+                          pool=None):
+        testcases = self.ordered_testcases()
+        max_item_len = max(len(testcase.name)
+                           for testcase in testcases) + max_submission_name_len - len(self.name)
 
         bar = ProgressBar('Running ' + self.name,
-                          count=len(runs),
+                          count=len(testcases),
                           max_len=max_item_len,
                           needs_leading_newline=needs_leading_newline)
 
         max_duration = -1
+        max_memory = None
+
+        # Show the duration without the startup time for languages that start slowly.
+        startup = calibrate.startup(self.language)
+        show_net = startup is not None and startup >= config.NET_DURATION_THRESHOLD
+
+        # color is restored after the estimated duration on the judge, see `bt calibrate`.
+        def format_duration(duration, color=cc.reset):
+            text = f'{duration:6.3f}s '
+            if show_net: text += f'(net {calibrate.net_duration(self.language, duration):6.3f}s) '
+            judge = calibrate.judge_duration(duration)
+            if judge is None: return text
+            # Like a TLE verdict, the estimate is orange when it exceeds the time limit.
+            if judge > self.problem.settings.timelimit:
+                return text + f'{cc.orange}(≈ {judge:6.3f}s on judge){color} '
+            return text + f'(≈ {judge:6.3f}s on judge) '
 
         verdict = (-100, 'ACCEPTED', 'ACCEPTED', 0)  # priority, verdict, print_verdict, duration
         verdict_run = None
+        results = []
+        # The results of the runs and the number of skipped runs of each test group.
+        group_results = dict()
+        group_skipped = dict()
 
-        # TODO: Run multiple runs in parallel.
-        for run in runs:
+        # The runs that were executed, for the run history.
+        runs = []
+
+        for testcase in testcases:
+            run = Run(self.problem, self, testcase) if queue is None else queue.next(self)
+            assert run.testcase is testcase
             bar.start(run)
-            result = run.run()
+            group = testcase.test_group
+            if self.skips(testcase):
+                group_skipped[group] = group_skipped.get(group, 0) + 1
+                bar.done()
+                continue
+            if queue is None:
+                result = run.run()
+            else:
+                pool.wait_until(lambda: run.result is not None)
+                result = run.result
+            runs.append(run)
 
             new_verdict = (config.PRIORITY[result.verdict], result.verdict, result.print_verdict(),
                            result.duration)
@@ -334,9 +845,12 @@ class Submission(program.Program):
                 verdict = new_verdict
                 verdict_run = run
             max_duration = max(max_duration, result.duration)
+            if result.memory is not None: max_memory = max(max_memory or 0, result.memory)
 
             if table_dict is not None:
                 table_dict[run.name] = result.verdict == 'ACCEPTED'
+            if table_results is not None: table_results[run.name] = result
+            if group is not None: group_results.setdefault(group, []).append(result)
 
             got_expected = result.verdict in ['ACCEPTED'] + self.expected_verdicts
 
@@ -351,16 +865,42 @@ class Submission(program.Program):
                 if result.out:
                     data = crop_output(result.out)
 
-            bar.done(got_expected, f'{result.duration:6.3f}s {result.print_verdict()}', data)
-
-            # Lazy judging: stop on the first error when not in verbose mode.
-            if (not config.args.verbose and not getattr(config.args, 'table', False)) and result.verdict in config.MAX_PRIORITY_VERDICT:
+            message = format_duration(result.duration, cc.green if got_expected else cc.red)
+            message += format_memory(result.memory)
+            message += result.print_verdict()
+            if result.durations:
+                message += (f' (min {result.durations[0]:.3f}s,'
+                            f' median {statistics.median(result.durations):.3f}s,'
+                            f' sd {statistics.pstdev(result.durations):.3f}s)')
+            if result.borderline is not None:
+                message += f' (borderline, first {result.borderline:.3f}s)'
+                self.borderline_runs.append(run)
+            if result.core is not None: message += f' (core {result.core})'
+            if result.cached: message += ' (cached)'
+            bar.done(got_expected, message, data)
+            results.append(result)
+
+            if not lazy_judging(): continue
+            # Skip the remaining testcases of a test group once one of them is rejected.
+            rejected = config.PRIORITY[result.verdict] > config.PRIORITY['ACCEPTED']
+            if rejected and group is not None and self.problem.on_reject(group) == 'break':
+                self._rejected_groups.add(group)
+            # Other test groups are still judged when the directory containing them continues.
+            if result.verdict in config.MAX_PRIORITY_VERDICT and (
+                    group is None or self.problem.on_reject(str(Path(group).parent)) == 'break'):
                 bar.count = None
+                if pool is not None: self.cancel(pool)
                 break
 
+        if queue is not None: queue.drop(self)
+
+        self._write_history(runs)
+        history.record(self, runs)
+
         self.verdict = verdict[1]
         self.print_verdict = verdict[2]
         self.duration = max_duration
+        self.net_duration = calibrate.net_duration(self.language, max_duration)
 
         # Use a bold summary line if things were printed before.
         if bar.logged:
@@ -370,13 +910,29 @@ class Submission(program.Program):
             color = cc.green if self.verdict in self.expected_verdicts else cc.red
             boldcolor = ''
 
-        printed_newline = bar.finalize(
-            message=
-            f'{max_duration:6.3f}s {color}{self.print_verdict:<20}{cc.reset} @ {verdict_run.testcase.name}'
-        )
+        report.write_submission(self, results, verdict_run)
+
+        message = f'{format_duration(max_duration)}{format_memory(max_memory)}{color}{self.print_verdict:<20}{cc.reset} @ {verdict_run.testcase.name}'
+        if group_results or group_skipped:
+            message += '\n' + Submission._format_groups(group_results, group_skipped)
+        printed_newline = bar.finalize(message=message)
 
         return (self.verdict in self.expected_verdicts, printed_newline)
 
+    # The verdict of each test group, which is the highest priority verdict of its runs, and the
+    # number of its testcases that were skipped.
+    @staticmethod
+    def _format_groups(group_results, group_skipped):
+        parts = []
+        # A testcase is only skipped after another testcase of its group was judged.
+        for group in sorted(group_results):
+            verdict = max((r.verdict for r in group_results[group]), key=config.PRIORITY.get)
+            color = cc.green if verdict == 'ACCEPTED' else cc.red
+            part = f'{Path(group).relative_to("secret")} {color}{verdict}{cc.reset}'
+            if group in group_skipped: part += f' ({group_skipped[group]} skipped)'
+            parts.append(part)
+        return '  groups: ' + ', '.join(parts)
+
     def test(self):
         print(ProgressBar.action('Running', str(self.name)))
 
@@ -402,6 +958,8 @@ class Submission(program.Program):
                                           timeout=self.problem.settings.timeout)
 
                 assert result.err is None and result.out is None
+                # The TLE status uses the estimated duration on the judge when it is known.
+                judge = calibrate.judge_duration(result.duration)
                 if result.duration > self.problem.settings.timeout:
                     status = f'{cc.red}Aborted!'
                     config.n_error += 1
@@ -411,19 +969,22 @@ class Submission(program.Program):
                     print(
                         f'{cc.red}Run time error!{cc.reset} exit code {result.ok} {cc.bold}{result.duration:6.3f}s{cc.reset}'
                     )
-                elif result.duration > self.problem.settings.timelimit:
+                elif (judge
+                      if judge is not None else result.duration) > self.problem.settings.timelimit:
                     status = f'{cc.orange}Done (TLE):'
                     config.n_warn += 1
                 else:
                     status = f'{cc.green}Done:'
 
                 if status:
-                    print(f'{status}{cc.reset} {cc.bold}{result.duration:6.3f}s{cc.reset}')
+                    print(f'{status}{cc.reset} {cc.bold}{result.duration:6.3f}s{cc.reset}' +
+                          (f' (≈ {judge:6.3f}s on judge)' if judge is not None else ''))
                 print()
 
             else:
                 # Interactive problem.
                 run = Run(self.problem, self, testcase)
+                run.make_dirs()
                 result = interactive.run_interactive_testcase(run,
                                                               interaction=True,
                                                               validator_error=None,
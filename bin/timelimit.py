@@ -0,0 +1,86 @@
+import math
+
+import config
+import program
+
+from util import *
+
+
+# Round up to a multiple of 0.1s.
+def _round_up(duration):
+    return math.ceil(round(duration * 10, 6)) / 10
+
+
+# Run the accepted and time_limit_exceeded submissions and report the slowest AC time per
+# language, the fastest TLE time, and a suggested time limit that is at least --ac-factor times
+# the slowest AC time and at most --tle-factor times the fastest TLE time.
+# Results are stored in the ResultCache (see `bt run --cached`), so only runs of changed
+# submissions and testcases are executed again.
+def timelimit(problem):
+    if not config.args.submissions:
+        config.args.submissions = [
+            Path('submissions') / verdict.lower()
+            for verdict in ['ACCEPTED', 'TIME_LIMIT_EXCEEDED']
+            if (problem.path / 'submissions' / verdict.lower()).is_dir()
+        ]
+        if not config.args.submissions:
+            error('No accepted or time_limit_exceeded submissions found.')
+            return False
+    config.args.testcases = []
+    config.args.cached = True
+
+    problem.run_submissions()
+    submissions = problem.submissions()
+    if submissions is False: return False
+
+    slowest_ac = dict()
+    for submission in submissions['ACCEPTED']:
+        if submission.verdict != 'ACCEPTED': continue
+        language = program.languages()[submission.language]['name']
+        if language not in slowest_ac or submission.duration > slowest_ac[language].duration:
+            slowest_ac[language] = submission
+
+    fastest_tle = None
+    for submission in submissions['TIME_LIMIT_EXCEEDED']:
+        if submission.verdict != 'TIME_LIMIT_EXCEEDED':
+            warn(f'{submission.name} does not exceed the time limit. Ignoring it.')
+            continue
+        if fastest_tle is None or submission.duration < fastest_tle.duration:
+            fastest_tle = submission
+
+    if not slowest_ac:
+        error('No accepted submission passed all testcases.')
+        return False
+
+    max_ac = max(s.duration for s in slowest_ac.values())
+    name_len = max(len(language) for language in slowest_ac)
+
+    print(f'\nTime limit analysis for timelimit {problem.settings.timelimit}s:')
+    print('Slowest AC per language:')
+    for language, submission in sorted(slowest_ac.items()):
+        # The net duration shows how much of the time is spent on starting the program.
+        net = ''
+        if submission.net_duration is not None:
+            net = f' (net {submission.net_duration:6.3f}s)'
+        print(f'  {language:<{name_len}}  {submission.duration:6.3f}s{net}  {submission.name}')
+
+    lower = _round_up(config.args.ac_factor * max_ac)
+    upper = None
+    if fastest_tle is None:
+        print('Fastest TLE: none')
+    else:
+        min_tle = fastest_tle.duration
+        aborted = ''
+        if min_tle >= problem.settings.timeout:
+            aborted = ' (aborted at the timeout, use -t to measure longer)'
+        print(f'Fastest TLE: {min_tle:6.3f}s  {fastest_tle.name}{aborted}')
+        print(f'Ratio fastest TLE / slowest AC: {min_tle / max_ac:.2f}')
+        upper = config.args.tle_factor * min_tle
+
+    policy = f'at least {config.args.ac_factor:g}x the slowest AC'
+    if upper is not None:
+        policy += f' and at most {config.args.tle_factor:g}x the fastest TLE'
+    if upper is not None and lower > upper:
+        warn(f'No time limit is {policy} ({lower}s > {upper:.3f}s).')
+    print(f'{cc.bold}Suggested timelimit: {lower}s{cc.reset} ({policy})')
+    return True
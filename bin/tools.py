@@ -15,6 +15,7 @@ Bommel.
 """
 
 import argparse
+import contextlib
 import hashlib
 import os
 import sys
@@ -26,12 +27,18 @@ from pathlib import Path
 # Local imports
 import config
 import constraints
+import calibrate
+import deterministic
+import diffrun
 import export
 import generate
 import latex
 import run
 import skel
 import stats
+import history
+import timelimit
+import workspace
 import validate
 import signal
 
@@ -194,6 +201,65 @@ Run this from one of:
     global_parser.add_argument('--force_build',
                                action='store_true',
                                help='Force rebuild instead of only on changed files.')
+    global_parser.add_argument(
+        '--workspace',
+        type=Path,
+        default=os.environ.get('BAPCTOOLS_WORKSPACE'),
+        help='Directory for the output of runs. Default is $BAPCTOOLS_WORKSPACE, or /dev/shm '
+        'when it has room for the quota, or the tmpdir.')
+    global_parser.add_argument(
+        '--workspace-quota',
+        type=int,
+        default=config.WORKSPACE_QUOTA,
+        help='Evict the oldest run files of a problem above this many MiB. Default is '
+        f'{config.WORKSPACE_QUOTA}.')
+
+    # Options for running submissions.
+    timing_parser = argparse.ArgumentParser(add_help=False)
+    timing_parser.add_argument('--timeout', '-t', type=int, help='Override the default timeout.')
+    timing_parser.add_argument('--jobs',
+                               '-j',
+                               type=int,
+                               default=1,
+                               help='The number of testcases to run in parallel. Default is 1.')
+    timing_parser.add_argument('--repeat',
+                               type=int,
+                               default=1,
+                               help='Run each submission N times on each testcase.')
+    timing_parser.add_argument(
+        '--repeat-stat',
+        choices=['min', 'median', 'max'],
+        default='median',
+        help='With --repeat, the statistic of the durations that determines the verdict.')
+    timing_parser.add_argument(
+        '--borderline',
+        type=float,
+        metavar='FRACTION',
+        help='Measure runs within this fraction of the time limit again, one at a time. '
+        'Off by default. Only with --pin the new measurements are isolated from the other jobs.')
+    timing_parser.add_argument('--pin',
+                               action='store_true',
+                               help='Pin each parallel job to its own CPU core.')
+    timing_parser.add_argument(
+        '--reserve-cores',
+        type=int,
+        default=1,
+        help='With --pin, the number of cores to keep free for BAPCtools itself. Default is 1.')
+    timing_parser.add_argument(
+        '--output-limit',
+        type=int,
+        metavar='MIB',
+        help='Override the output limit from problem.yaml, in MiB. The default is 8 MiB.')
+    timing_parser.add_argument(
+        '--pipe',
+        action='store_true',
+        help='Stream the output of submissions into the output validator instead of a file.')
+    timing_parser.add_argument(
+        '--memory',
+        '-m',
+        help=
+        'Override the memory limit from problem.yaml, in MiB, or `unlimited`. The default is 1024.'
+    )
 
     subparsers = parser.add_subparsers(title='actions', dest='action')
     subparsers.required = True
@@ -293,7 +359,8 @@ Run this from one of:
                            help='Regenerate all data, including up to date test cases. ')
     genparser.add_argument('--check_deterministic',
                            action='store_true',
-                           help='Rerun all generators to make sure generators are deterministic.')
+                           help='Rerun all generators and solutions to make sure they are '
+                           'deterministic.')
     genparser.add_argument('--timeout', '-t', type=int, help='Override the default timeout.')
     genparser.add_argument('--samples',
                            action='store_true',
@@ -303,6 +370,14 @@ Run this from one of:
                            type=int,
                            default=4,
                            help='The number of jobs to use. Default is 4.')
+    genparser.add_argument('--pin',
+                           action='store_true',
+                           help='Pin each parallel job to its own CPU core.')
+    genparser.add_argument(
+        '--reserve-cores',
+        type=int,
+        default=1,
+        help='With --pin, the number of cores to keep free for BAPCtools itself. Default is 1.')
     genparser.add_argument('--add-manual',
                            action='store_true',
                            help='Add manual cases to generators.yaml.')
@@ -325,26 +400,166 @@ Run this from one of:
 
     # Run
     runparser = subparsers.add_parser('run',
-                                      parents=[global_parser],
+                                      parents=[global_parser, timing_parser],
                                       help='Run multiple programs against some or all input.')
     runparser.add_argument('submissions',
                            nargs='*',
                            type=Path,
                            help='optionally supply a list of programs and testcases to run')
     runparser.add_argument('--samples', action='store_true', help='Only run on the samples.')
+    runparser.add_argument(
+        '--quick',
+        type=int,
+        metavar='K',
+        help='Only run on the samples and at most K testcases of each directory in data/secret.')
+    runparser.add_argument('--seed',
+                           type=int,
+                           default=0,
+                           help='The seed for choosing --quick testcases. Default is 0.')
     runparser.add_argument('--no-generate',
                            '-G',
                            action='store_true',
                            help='Do not run `generate` before running submissions.')
-    runparser.add_argument('--table',
-                           action='store_true',
-                           help='Print a submissions x testcases table for analysis.')
-    runparser.add_argument('--timeout', '-t', type=int, help='Override the default timeout.')
+    runparser.add_argument(
+        '--table',
+        action='store_true',
+        help='Print a submissions x testcases table for analysis. Implies --cached.')
+    runparser.add_argument(
+        '--table-only',
+        action='store_true',
+        help='Print the --table from the stored results of earlier runs, without running anything.'
+    )
+    runparser.add_argument(
+        '--minimal-testset',
+        action='store_true',
+        help=
+        'Print a small set of testcases that fails all submissions that should fail. Implies --table.'
+    )
+    runparser.add_argument(
+        '--keep-slowest',
+        action='store_true',
+        help='Also keep the slowest testcase of each accepted submission. Implies --minimal-testset.'
+    )
     runparser.add_argument('--timelimit', type=int, help='Override the default timelimit.')
     runparser.add_argument(
-        '--memory',
-        '-m',
-        help='The max amount of memory (in bytes) a subprocesses may use. Does not work for java.')
+        '--fast-tle',
+        action='store_true',
+        help=
+        'Kill submissions that should time out shortly after the timelimit, instead of at the timeout.'
+    )
+    runparser.add_argument(
+        '--cached',
+        action='store_true',
+        help=
+        'Reuse results of earlier --cached runs with the same program, testcase, validators and limits.'
+    )
+    runparser.add_argument(
+        '--history-db',
+        type=Path,
+        metavar='FILE',
+        help='The SQLite database to append results to. Default is history.sqlite in the tmpdir.')
+    runparser.add_argument('--report',
+                           type=Path,
+                           metavar='FILE',
+                           help='Write a JSON record for every run and submission to FILE.')
+
+    # Run history
+    historyparser = subparsers.add_parser('history',
+                                          parents=[global_parser],
+                                          help='Show timing trends and regressions of past runs.')
+    historyparser.add_argument('submissions',
+                               nargs='*',
+                               type=Path,
+                               help='Only show these submissions or submission directories.')
+    historyparser.add_argument(
+        '--history-db',
+        type=Path,
+        metavar='FILE',
+        help='The SQLite database to read. Default is history.sqlite in the tmpdir.')
+    historyparser.add_argument('--last',
+                               type=int,
+                               default=5,
+                               help='The number of recent invocations to show. Default is 5.')
+    historyparser.add_argument(
+        '--threshold',
+        type=float,
+        default=20,
+        help='Flag testcases this many percent slower than in the previous run. Default is 20.')
+    historyparser.add_argument('--slowest',
+                               type=int,
+                               default=10,
+                               help='The number of slowest testcases to show. Default is 10.')
+
+    # Time limit analysis
+    timelimitparser = subparsers.add_parser(
+        'timelimit',
+        parents=[global_parser, timing_parser],
+        help='Suggest a time limit from the durations of the AC and TLE submissions.')
+    timelimitparser.add_argument(
+        'submissions',
+        nargs='*',
+        type=Path,
+        help='The submissions to use. Default is all accepted and time_limit_exceeded submissions.'
+    )
+    timelimitparser.add_argument(
+        '--ac-factor',
+        type=float,
+        default=2,
+        help='The time limit must be at least this factor times the slowest AC time. Default is 2.'
+    )
+    timelimitparser.add_argument(
+        '--tle-factor',
+        type=float,
+        default=0.5,
+        help='The time limit must be at most this factor times the fastest TLE time. Default is 0.5.'
+    )
+
+    # Differential run
+    diffrunparser = subparsers.add_parser(
+        'diffrun',
+        parents=[global_parser, timing_parser],
+        help='Compare the output of two submissions on all testcases, without validators.')
+    diffrunparser.add_argument('submissions',
+                               nargs='+',
+                               type=Path,
+                               help='Two submissions, optionally followed by testcases.')
+    diffrunparser.add_argument('--samples', action='store_true', help='Only run on the samples.')
+
+    # Nondeterminism check of submissions
+    deterministicparser = subparsers.add_parser(
+        'deterministic',
+        parents=[global_parser, timing_parser],
+        help='Run submissions multiple times on each testcase and check that the output is equal.')
+    deterministicparser.add_argument(
+        'submissions',
+        nargs='*',
+        type=Path,
+        help='Submissions and testcases to run. Default is all accepted submissions.')
+    deterministicparser.add_argument('--runs',
+                                     type=int,
+                                     default=3,
+                                     help='Number of runs per testcase. Default is 3.')
+    deterministicparser.add_argument('--seed',
+                                     type=int,
+                                     default=0,
+                                     help='Seed for the order of the runs. Default is 0.')
+    deterministicparser.add_argument('--samples',
+                                     action='store_true',
+                                     help='Only run on the samples.')
+
+    # Startup time calibration
+    calibrateparser = subparsers.add_parser(
+        'calibrate',
+        parents=[global_parser],
+        help='Measure the startup time of each language and a benchmark score of this machine.')
+    calibrateparser.add_argument(
+        'languages',
+        nargs='*',
+        help='The languages from languages.yaml to measure. Default is all installed languages.')
+    calibrateparser.add_argument(
+        '--judge-score',
+        type=float,
+        help='Store the benchmark score of the judge machine instead of measuring this machine.')
 
     # Test
     testparser = subparsers.add_parser('test',
@@ -407,6 +622,9 @@ Run this from one of:
         'tmp',
         parents=[global_parser],
         help='Print the tmpdir corresponding to the current problem.')
+    tmpparser.add_argument('--usage',
+                           action='store_true',
+                           help='Print the disk usage of the tmpdir and the workspace.')
     tmpparser.add_argument(
         '--clean',
         action='store_true',
@@ -419,18 +637,40 @@ Run this from one of:
 
 
 # Takes a Namespace object returned by argparse.parse_args().
+# With --minimal-testset, everything but its testcase paths is printed to stderr, so that stdout
+# can be passed to bt run directly.
 def run_parsed_arguments(args):
+    if getattr(args, 'minimal_testset', False) or getattr(args, 'keep_slowest', False):
+        with contextlib.redirect_stdout(sys.stderr):
+            _run_parsed_arguments(args)
+    else:
+        _run_parsed_arguments(args)
+
+
+def _run_parsed_arguments(args):
     # Process arguments
     config.args = args
     action = config.args.action
 
     # Parse arguments for 'run' command.
-    if action == 'run':
+    if action in ['run', 'diffrun', 'deterministic']:
         if config.args.submissions:
             config.args.submissions, config.args.testcases = split_submissions_and_testcases(
                 config.args.submissions)
         else:
             config.args.testcases = []
+    if action == 'run':
+        if config.args.keep_slowest: config.args.minimal_testset = True
+        if config.args.minimal_testset and not config.args.table_only: config.args.table = True
+        if config.args.table_only:
+            config.args.table = True
+            config.args.no_generate = True
+        # Each cell of the table is stored in the ResultCache as soon as it is known, so that an
+        # interrupted --table run continues where it stopped.
+        if config.args.table: config.args.cached = True
+        # These paths are relative to the current directory, not the problem directory.
+        if config.args.report: config.args.report = config.args.report.resolve()
+        if config.args.history_db: config.args.history_db = config.args.history_db.resolve()
 
     # Skel commands.
     if action in ['new_contest']:
@@ -483,8 +723,10 @@ def run_parsed_arguments(args):
     if action == 'tmp':
         if level == 'problem':
             level_tmpdir = tmpdir / problems[0].name
+            level_workspace = problems[0].workspace
         else:
             level_tmpdir = tmpdir
+            level_workspace = workspace.root(tmpdir)
 
         if config.args.clean:
             log(f'Deleting {tmpdir}!')
@@ -492,6 +734,10 @@ def run_parsed_arguments(args):
                 shutil.rmtree(level_tmpdir)
             if level_tmpdir.is_file():
                 level_tmpdir.unlink()
+            if level_workspace.is_dir():
+                shutil.rmtree(level_workspace)
+        elif config.args.usage:
+            workspace.print_usage(level_tmpdir, level_workspace)
         else:
             print(level_tmpdir)
 
@@ -501,6 +747,11 @@ def run_parsed_arguments(args):
         stats.stats(problems)
         return
 
+    # The startup times are per machine, so any problem can be used to build the programs.
+    if action == 'calibrate':
+        if not calibrate.calibrate(problems[0]) or config.n_error > 0: sys.exit(1)
+        return
+
     if action == 'sort':
         print_sorted(problems)
         return
@@ -543,7 +794,7 @@ def run_parsed_arguments(args):
             config.args.clean = False
             if action in ['all', 'constraints']:
                 config.args.check_deterministic = True
-            config.args.jobs = 4
+            if not hasattr(config.args, 'jobs'): config.args.jobs = 4
             config.args.add_manual = False
             config.args.move_manual = False
             config.args.testcases = None
@@ -554,6 +805,14 @@ def run_parsed_arguments(args):
             success &= problem.validate_format('output_format')
         if action in ['run', 'all']:
             success &= problem.run_submissions()
+        if action in ['history']:
+            success &= history.show(problem)
+        if action in ['timelimit']:
+            success &= timelimit.timelimit(problem)
+        if action in ['diffrun']:
+            success &= diffrun.diffrun(problem)
+        if action in ['deterministic']:
+            success &= deterministic.deterministic(problem)
         if action in ['test']:
             config.args.no_bar = True
             success &= problem.test_submissions()
@@ -3,6 +3,7 @@
 import shutil
 import config
 import time
+import math
 import copy
 import yaml
 import subprocess
@@ -12,6 +13,7 @@ import re
 import yaml
 import threading
 import signal
+import errno
 
 from pathlib import Path
 
@@ -522,8 +524,8 @@ def crop_output(output):
     return output
 
 
-# TODO: Move this to Problem.settings and read limits.memory variable from problem.yaml.
-# Return memory limit in bytes.
+# Return the memory limit in MiB from --memory, or None when it is unlimited.
+# Submissions use Problem.settings.memory_limit instead, which also reads problem.yaml.
 def get_memory_limit(kwargs=None):
     memory_limit = 1024  # 1GB
     if hasattr(config.args, 'memory'):
@@ -538,24 +540,70 @@ def get_memory_limit(kwargs=None):
     return memory_limit
 
 
+# `core` is the CPU the process was pinned to, or None when it was not pinned.
+# `cached` is True when the result was replayed from the ResultCache instead of executed.
+# `durations` is the sorted list of all measured durations when the run was repeated (--repeat).
+# `memory` is the peak resident memory in bytes, or None when unknown.
+# `wall_time` is the elapsed real time, while `duration` is the CPU time when it is known.
+# `exit_code` and `stderr` are those of the submission for judged runs, see Run._execute.
+# `borderline` is the original duration when it was close to the time limit and the run was
+# measured again (--borderline). The other fields then describe the new measurements.
 class ExecResult:
-    def __init__(self, ok, duration, err, out, verdict=None, print_verdict=None):
+    def __init__(self, ok, duration, err, out, verdict=None, print_verdict=None, core=None):
         self.ok = ok
         self.duration = duration
         self.err = err
         self.out = out
         self.verdict = verdict
         self.print_verdict_ = print_verdict
+        self.core = core
+        self.cached = False
+        self.durations = None
+        self.memory = None
+        self.wall_time = None
+        self.exit_code = None
+        self.stderr = None
+        self.borderline = None
 
     def print_verdict(self):
         if self.print_verdict_: return self.print_verdict_
         return self.verdict
 
 
-def limit_setter(command, timeout, memory_limit):
+# Processes started by exec_command from a thread are pinned to the core set with pin_thread.
+_thread_state = threading.local()
+
+
+# Pin all processes that exec_command starts from the current thread to the given core.
+# Pass None to unpin.
+def pin_thread(core):
+    _thread_state.core = core
+
+
+def pinned_core():
+    return getattr(_thread_state, 'core', None)
+
+
+# Whether the process of result exceeded the output limit of output_limit MiB while writing path.
+# Most processes are killed by SIGXFSZ, but CPython and the JVM ignore it: they get EFBIG instead
+# and usually exit with an error. Those are recognized by the size of path.
+def exceeds_output_limit(result, path, output_limit):
+    if result.ok == -signal.SIGXFSZ: return True
+    if result.ok is True or not output_limit or path is None: return False
+    return path.is_file() and path.stat().st_size >= output_limit * 1024 * 1024
+
+
+# output_limit is in MiB and limits the size of files written by the process, including its
+# stdout when that is a file. A process that exceeds it is killed by SIGXFSZ.
+def limit_setter(command, timeout, memory_limit, core=None, output_limit=None):
     def setlimits():
+        if core is not None:
+            os.sched_setaffinity(0, {core})
+
         if timeout:
-            resource.setrlimit(resource.RLIMIT_CPU, (timeout + 1, timeout + 1))
+            # The CPU limit is in whole seconds, while the timeout may be fractional.
+            cpu_limit = math.ceil(timeout) + 1
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_limit))
 
         # Increase the max stack size from default to the max available.
         if sys.platform != 'darwin':
@@ -565,15 +613,26 @@ def limit_setter(command, timeout, memory_limit):
         if memory_limit and not Path(command[0]).name in ['java', 'javac', 'kotlin', 'kotlinc']:
             resource.setrlimit(resource.RLIMIT_AS, (memory_limit*1024*1024, memory_limit*1024*1024))
 
+        if output_limit:
+            resource.setrlimit(resource.RLIMIT_FSIZE,
+                               (output_limit * 1024 * 1024, output_limit * 1024 * 1024))
+
         # Disable coredumps.
         resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
 
     return setlimits
 
+
 # Subclass Popen to get rusage information.
 class ResourcePopen(subprocess.Popen):
+    # rusage stays None when the process is reaped by a path that does not store it.
+    def __init__(self, *args, **kwargs):
+        self.rusage = None
+        super().__init__(*args, **kwargs)
+
     # If wait4 is available, store resource usage information.
     if 'wait4' in dir(os):
+
         def _try_wait(self, wait_flags):
             """All callers to this function MUST hold self._waitpid_lock."""
             try:
@@ -588,6 +647,7 @@ class ResourcePopen(subprocess.Popen):
                 self.rusage = res
             return (pid, sts)
     else:
+
         def _try_wait(self, wait_flags):
             """All callers to this function MUST hold self._waitpid_lock."""
             try:
@@ -602,6 +662,21 @@ class ResourcePopen(subprocess.Popen):
                 self.rusage = None
             return (pid, sts)
 
+
+# Kill a ResourcePopen without reaping it, so that the thread waiting for it still gets its
+# resource usage. Popen.kill() may reap the process when it just exited, for instance because it
+# was cancelled or killed by a MemoryWatchdog, without storing its resource usage.
+def kill_process(process):
+    if is_windows():
+        process.kill()
+        return
+    if process.returncode is not None: return
+    try:
+        os.kill(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
 # Run `command`, returning stderr if the return code is unexpected.
 def exec_command(command, expect=0, crop=True, **kwargs):
     # By default: discard stdout, return stderr
@@ -628,6 +703,7 @@ def exec_command(command, expect=0, crop=True, **kwargs):
         kwargs.pop('timeout')
 
     process = None
+
     def interrupt_handler(sig, frame):
         nonlocal process
         process.kill()
@@ -637,21 +713,32 @@ def exec_command(command, expect=0, crop=True, **kwargs):
         old_handler = signal.signal(signal.SIGINT, interrupt_handler)
 
     did_timeout = False
+    core = pinned_core()
+    output_limit = kwargs.pop('output_limit', None)
+    memory_limit = get_memory_limit(kwargs)
+    # With watch_memory, the peak resident memory is measured and the memory limit is enforced on
+    # it by a MemoryWatchdog, instead of on the address space.
+    watch_memory = kwargs.pop('watch_memory', False) and MemoryWatchdog.supported()
+    watchdog = None
+    cancellation = kwargs.pop('cancellation', None)
 
     tstart = time.monotonic()
     try:
         if not is_windows():
             process = ResourcePopen(command,
-                                       preexec_fn=limit_setter(command, timeout,
-                                                               get_memory_limit(kwargs)),
-                                       **kwargs)
+                                    preexec_fn=limit_setter(command, timeout,
+                                                            None if watch_memory else memory_limit,
+                                                            core, output_limit),
+                                    **kwargs)
         else:
             process = ResourcePopen(command, **kwargs)
+        if watch_memory: watchdog = MemoryWatchdog(process, memory_limit)
+        if cancellation is not None: cancellation.add(process)
         (stdout, stderr) = process.communicate(timeout=timeout)
     except subprocess.TimeoutExpired:
         # Timeout expired.
         did_timeout = True
-        process.kill()
+        kill_process(process)
         (stdout, stderr) = process.communicate()
     except PermissionError as e:
         # File is likely not executable.
@@ -664,6 +751,8 @@ def exec_command(command, expect=0, crop=True, **kwargs):
         stderr = str(e)
         return ExecResult(-1, 0, stderr, stdout)
     tend = time.monotonic()
+    memory = watchdog.stop() if watchdog is not None else None
+    if cancellation is not None: cancellation.remove(process)
 
     if threading.current_thread() is threading.main_thread():
         signal.signal(signal.SIGINT, old_handler)
@@ -679,13 +768,274 @@ def exec_command(command, expect=0, crop=True, **kwargs):
     err = maybe_crop(stderr.decode('utf-8')) if stderr is not None else None
     out = maybe_crop(stdout.decode('utf-8')) if stdout is not None else None
 
+    duration = _duration(process, did_timeout, tend - tstart)
+    result = ExecResult(ok, duration, err, out, core=core)
+    result.memory = memory
+    result.wall_time = tend - tstart
+    return result
+
+
+# A set of running processes that can all be killed from another thread, for instance when their
+# results are not needed anymore. Processes are added by exec_command and exec_pipeline when they
+# are passed cancellation=. Processes started after cancel() was called are killed right away.
+# Killed processes are still reaped by the thread that started them.
+class Cancellation:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self.cancelled = False
+
+    def add(self, process):
+        with self._lock:
+            if not self.cancelled:
+                self._processes.add(process)
+                return
+        kill_process(process)
+
+    def remove(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+        for process in processes:
+            kill_process(process)
+
+
+# Format a memory size in bytes as shown next to durations, or '' when it is None.
+def format_memory(memory):
+    if memory is None: return ''
+    return f'{memory / 1024 / 1024:6.1f}MiB '
+
+
+# Samples the peak resident memory of a running process, and kills it as soon as its resident
+# memory exceeds memory_limit MiB, when given, by polling /proc/<pid>/status. Unlike RLIMIT_AS,
+# this also works for the JVM, which reserves much more address space than it uses.
+# The peak is VmHWM, which starts at zero when the process calls exec. Unlike ru_maxrss, it does
+# not include the memory of BAPCtools that the process inherited when it was forked. peak is None
+# when the process exited before it was sampled.
+class MemoryWatchdog:
+    INTERVAL = 0.01
+
+    @staticmethod
+    def supported():
+        return Path('/proc/self/status').is_file()
+
+    def __init__(self, process, memory_limit=None):
+        self.process = process
+        self.limit = memory_limit * 1024 * 1024 if memory_limit else None
+        self.peak = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        status = Path('/proc') / str(self.process.pid) / 'status'
+        while True:
+            try:
+                lines = status.read_text().splitlines()
+            except OSError:
+                return
+            values = {
+                line.split(':')[0]: int(line.split()[1]) * 1024
+                for line in lines
+                if line.startswith(('VmHWM:', 'VmRSS:'))
+            }
+            # Zombie processes have no memory lines. Right after exec, no pages are counted yet.
+            if 'VmHWM' not in values: return
+            if values['VmHWM']: self.peak = values['VmHWM']
+            if self.limit is not None and values['VmRSS'] > self.limit:
+                kill_process(self.process)
+                return
+            if self._stopped.wait(MemoryWatchdog.INTERVAL): return
+
+    # Stop polling and return the peak resident memory in bytes, or None when it is unknown.
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.peak
+
+
+# The CPU time used by a finished ResourcePopen, or the wall time when that is not available.
+def _duration(process, did_timeout, wall_time):
     if process.rusage:
         duration = process.rusage.ru_utime + process.rusage.ru_stime
         # It may happen that the Rusage is low, even though a timeout was raised, i.e. when calling sleep().
         # To prevent under-reporting the duration, we take the max with wall time in this case.
         if did_timeout:
-            duration = max(tend-tstart, duration)
-    else:
-        duration = tend - tstart
+            duration = max(wall_time, duration)
+        return duration
+    return wall_time
+
+
+# Run command with its stdout connected to the stdin of validator_command, so that the validator
+# reads the output while it is produced. Returns an ExecResult for each of the two processes.
+#
+# Only command is limited by timeout, and the duration is that of command only. The validator
+# runs unpinned, so it does not compete with command for its core.
+# When tee is a path, the output is also written to that file. When the validator exits before
+# command, the rest of the output is only written to tee when tee_rest is True. Otherwise command
+# gets SIGPIPE, as without tee.
+# output_limit is in MiB. When the output exceeds it, command is killed and its returncode is
+# -SIGXFSZ, as when it writes a regular file beyond RLIMIT_FSIZE.
+# When the validator rejects the output, command is considered to have succeeded when it only
+# failed because its stdout was closed: it got SIGPIPE, or, like CPython, it ignores SIGPIPE and
+# reported the EPIPE error. Any other failure is reported as is.
+# Both processes are killed when the given Cancellation is cancelled.
+def exec_pipeline(command,
+                  validator_command,
+                  *,
+                  stdin,
+                  cwd,
+                  validator_cwd,
+                  timeout,
+                  validator_expect,
+                  tee=None,
+                  tee_rest=False,
+                  output_limit=None,
+                  memory=None,
+                  cancellation=None,
+                  crop=True):
+    command = [str(x) for x in command]
+    validator_command = [str(x) for x in validator_command]
+
+    if config.args.verbose >= 2:
+        print('cd', cwd, '; ', *command, ' < ', stdin.name, ' | ', *validator_command, sep=' ')
+
+    core = pinned_core()
+    memory_limit = get_memory_limit({'memory': memory} if memory is not None else None)
+    watch_memory = MemoryWatchdog.supported()
+    kwargs = dict()
+    validator_kwargs = dict()
+    if not is_windows():
+        kwargs['preexec_fn'] = limit_setter(
+            command, timeout, None if watch_memory else memory_limit, core, output_limit)
+        validator_kwargs['preexec_fn'] = limit_setter(validator_command, None, get_memory_limit())
+
+    tstart = time.monotonic()
+    try:
+        process = ResourcePopen(command,
+                                stdin=stdin,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                cwd=cwd,
+                                **kwargs)
+    except (PermissionError, OSError) as e:
+        return ExecResult(-1, 0, str(e), None), None
+    # From here on, process.stdout is only read by the copy thread below.
+    output, process.stdout = process.stdout, None
+
+    try:
+        validator = ResourcePopen(validator_command,
+                                  stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  cwd=validator_cwd,
+                                  **validator_kwargs)
+    except (PermissionError, OSError) as e:
+        process.kill()
+        process.communicate()
+        output.close()
+        return ExecResult(-1, 0, None, None), ExecResult(-1, 0, str(e), None)
+    validator_input, validator.stdin = validator.stdin, None
+    watchdog = MemoryWatchdog(process, memory_limit) if watch_memory else None
+    if cancellation is not None:
+        cancellation.add(process)
+        cancellation.add(validator)
+
+    # Copy the output to the validator and to tee, while counting its size.
+    output_limit_exceeded = False
+
+    def copy():
+        nonlocal output_limit_exceeded
+        tee_file = tee.open('wb') if tee is not None else None
+        to_validator = True
+        size = 0
+        while True:
+            data = output.read1(1 << 16)
+            if not data: break
+            size += len(data)
+            if output_limit and size > output_limit * 1024 * 1024:
+                output_limit_exceeded = True
+                kill_process(process)
+                break
+            if tee_file is not None: tee_file.write(data)
+            if to_validator:
+                try:
+                    validator_input.write(data)
+                except BrokenPipeError:
+                    to_validator = False
+                    # The rest of the output is not needed, so command gets SIGPIPE.
+                    if tee_file is None or not tee_rest: break
+        output.close()
+        if tee_file is not None: tee_file.close()
+        try:
+            validator_input.close()
+        except BrokenPipeError:
+            pass
+
+    threads = [threading.Thread(target=copy, daemon=True)]
+
+    # The validator is read on a separate thread, so that it never blocks on a full stderr pipe
+    # while command is still writing to it.
+    validator_output = [None, None]
+    validator_end = None
+
+    def communicate_validator():
+        nonlocal validator_end
+        try:
+            validator_output[:] = validator.communicate(timeout=timeout + 30 if timeout else None)
+        except subprocess.TimeoutExpired:
+            kill_process(validator)
+            validator_output[:] = validator.communicate()
+        validator_end = time.monotonic()
+
+    threads.append(threading.Thread(target=communicate_validator, daemon=True))
+    for t in threads:
+        t.start()
+
+    did_timeout = False
+    try:
+        (_, stderr) = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        did_timeout = True
+        kill_process(process)
+        (_, stderr) = process.communicate()
+    tend = time.monotonic()
+    memory = watchdog.stop() if watchdog is not None else None
+    for t in threads:
+        t.join()
+    if cancellation is not None:
+        cancellation.remove(process)
+        cancellation.remove(validator)
+
+    # -2 corresponds to SIGINT, i.e. keyboard interrupt / CTRL-C.
+    if process.returncode == -2 or validator.returncode == -2:
+        fatal('Child process interrupted.')
+
+    def maybe_crop(s):
+        return crop_output(s) if crop else s
 
-    return ExecResult(ok, duration, err, out)
+    validator_ok = True if validator.returncode == validator_expect else validator.returncode
+    ok = True if process.returncode == 0 else process.returncode
+    # A closed pipe is only possible once the validator stopped reading.
+    broken_pipe = ok == -signal.SIGPIPE or os.strerror(errno.EPIPE).encode() in stderr
+    if ok is not True and not did_timeout and validator_ok is not True and broken_pipe:
+        ok = True
+    if output_limit_exceeded: ok = -signal.SIGXFSZ
+
+    result = ExecResult(ok,
+                        _duration(process, did_timeout, tend - tstart),
+                        maybe_crop(stderr.decode('utf-8')),
+                        None,
+                        core=core)
+    result.memory = memory
+    result.wall_time = tend - tstart
+    validator_stdout, validator_stderr = validator_output
+    validator_result = ExecResult(validator_ok, _duration(validator, False,
+                                                          validator_end - tstart),
+                                  maybe_crop(validator_stderr.decode('utf-8')),
+                                  maybe_crop(validator_stdout.decode('utf-8')))
+    return result, validator_result
@@ -145,11 +145,14 @@ class OutputValidator(Validator):
             return False
 
         with run.out_path.open() as out_file:
-            return exec_command(
-                self.run_command +
-                [testcase.in_path.resolve(),
-                 testcase.ans_path.resolve(), run.feedbackdir] +
-                self.problem.settings.validator_flags,
-                expect=config.RTV_AC,
-                stdin=out_file,
-                cwd=run.feedbackdir)
+            return exec_command(self.team_output_command(testcase, run),
+                                expect=config.RTV_AC,
+                                stdin=out_file,
+                                cwd=run.feedbackdir)
+
+    # The command that validates the output of the given run, which is read from stdin.
+    def team_output_command(self, testcase, run):
+        return self.run_command + [
+            testcase.in_path.resolve(),
+            testcase.ans_path.resolve(), run.feedbackdir
+        ] + self.problem.settings.validator_flags
@@ -0,0 +1,97 @@
+import os
+import shutil
+
+import config
+
+from util import *
+
+# The workspace chosen for each tmpdir, and the config.args it was chosen for.
+_roots = dict()
+_args = None
+
+
+def _quota():
+    quota = getattr(config.args, 'workspace_quota', None)
+    return (config.WORKSPACE_QUOTA if quota is None else quota) * 2**20
+
+
+# The directory where runs write their output, feedback and scratch files, with one directory per
+# problem like the tmpdir. It is --workspace when given, else /dev/shm when it has room for the
+# --workspace-quota, and else the tmpdir itself.
+def root(tmpdir):
+    global _roots, _args
+    if _args is not config.args:
+        _roots = dict()
+        _args = config.args
+    if tmpdir not in _roots:
+        base = getattr(config.args, 'workspace', None)
+        shm = Path('/dev/shm')
+        if base:
+            _roots[tmpdir] = Path(base).resolve() / tmpdir.name
+        elif shm.is_dir() and os.access(shm, os.W_OK) and shutil.disk_usage(shm).free >= _quota():
+            _roots[tmpdir] = shm / tmpdir.name
+        else:
+            _roots[tmpdir] = tmpdir
+    return _roots[tmpdir]
+
+
+# The files in the runs directory of problem that may be evicted, as (mtime, size, path).
+# The history files of submissions and their scratch directories are kept.
+def _evictable(problem):
+    files = []
+    for dirpath, dirnames, filenames in os.walk(problem.workspace / 'runs'):
+        dirnames[:] = [d for d in dirnames if d != '.cwd']
+        for name in filenames:
+            if name == '.history.json': continue
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.lstat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+# Delete the oldest output and feedback files of runs of problem until their total size is at
+# most --workspace-quota MiB.
+def evict(problem):
+    files = _evictable(problem)
+    total = sum(size for _, size, _ in files)
+    quota = _quota()
+    if total <= quota: return
+    evicted = 0
+    for _, size, path in sorted(files):
+        if total <= quota: break
+        os.unlink(path)
+        total -= size
+        evicted += 1
+    log(f'Evicted the {evicted} oldest run files to stay within the workspace quota of '
+        f'{quota / 2**20:.0f} MiB.')
+
+
+# The total size in bytes and the number of files below path.
+def _usage(path):
+    size, count = 0, 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                continue
+            count += 1
+    return size, count
+
+
+# Print the disk usage of the tmpdir and the workspace, see `bt tmp --usage`.
+def print_usage(tmpdir, workspace):
+    rows = [('tmpdir', tmpdir)]
+    if workspace != tmpdir: rows.append(('workspace', workspace))
+    for label, path in rows:
+        size, count = _usage(path) if path.is_dir() else (0, 0)
+        print(f'{label:<9}  {path}  {size / 2**20:8.1f} MiB in {count} files')
+    device = workspace
+    while not device.exists():
+        device = device.parent
+    free = shutil.disk_usage(device).free
+    print(f'Run files are evicted above {_quota() / 2**20:.0f} MiB per problem. '
+          f'{free / 2**30:.1f} GiB free on the workspace device.')
@@ -0,0 +1,51 @@
+from diffrun import OutputHash, describe_difference
+
+# 256 lines of 16 bytes fill one block.
+LINES_PER_BLOCK = OutputHash.BLOCK_SIZE // 16
+
+
+def output_hash(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return OutputHash.of_file(path)
+
+
+def lines(n):
+    return b''.join(b'%015d\n' % i for i in range(n))
+
+
+class TestOutputHash:
+    def test_identical(self, tmp_path):
+        a = output_hash(tmp_path, 'a', lines(1000))
+        b = output_hash(tmp_path, 'b', lines(1000))
+        assert a.first_difference(b) is None
+        empty = output_hash(tmp_path, 'empty', b'')
+        assert empty.first_difference(empty) is None
+
+    def test_difference_in_middle(self, tmp_path):
+        data = lines(3 * LINES_PER_BLOCK)
+        a = output_hash(tmp_path, 'a', data)
+        # Change one byte in the middle of the second block.
+        middle = OutputHash.BLOCK_SIZE + OutputHash.BLOCK_SIZE // 2
+        b = output_hash(tmp_path, 'b', data[:middle] + b'x' + data[middle + 1:])
+        assert a.first_difference(b) == 1
+        assert b.first_difference(a) == 1
+        size = len(data)
+        assert describe_difference(a, b, 1) == (
+            f'bytes 4096-8191 (from line {LINES_PER_BLOCK + 1}); sizes {size} and {size}')
+
+    def test_length_mismatch(self, tmp_path):
+        data = lines(LINES_PER_BLOCK)
+        a = output_hash(tmp_path, 'a', data)
+        # b only has extra output after the first block.
+        b = output_hash(tmp_path, 'b', data + b'extra\n')
+        assert a.first_difference(b) == 1
+        assert describe_difference(a, b, 1) == (
+            f'bytes 4096-4101 (from line {LINES_PER_BLOCK + 1}); sizes 4096 and 4102')
+        # The last, partial block of a shorter output differs from the full block.
+        c = output_hash(tmp_path, 'c', data[:-1])
+        assert a.first_difference(c) == 0
+        assert describe_difference(a, c, 0) == 'bytes 0-4095 (from line 1); sizes 4096 and 4095'
+        empty = output_hash(tmp_path, 'empty', b'')
+        assert empty.first_difference(a) == 0
+        assert describe_difference(empty, a, 0) == 'bytes 0-4095 (from line 1); sizes 0 and 4096'
@@ -0,0 +1,148 @@
+import argparse
+import json
+import pytest
+from pathlib import Path
+
+import config
+import problem
+
+
+class MockSubmission:
+    def __init__(self, name, expected_verdict):
+        self.name = name
+        self.expected_verdicts = [expected_verdict]
+
+
+class MockResult:
+    def __init__(self, verdict, duration=0.1):
+        self.verdict = verdict
+        self.duration = duration
+
+
+# Return a result table in which submission fails the given testcases and accepts the others.
+def results(failing, testcases=range(1, 5), durations=dict()):
+    return {
+        f'secret/{t}': MockResult('ACCEPTED' if t not in failing else 'WRONG_ANSWER',
+                                  durations.get(t, 0.1))
+        for t in testcases
+    }
+
+
+def minimal_testset(result_table, keep_slowest=False):
+    cost = dict()
+    for _, table in result_table:
+        for name, result in table.items():
+            cost[name] = cost.get(name, 0) + result.duration
+    return problem.Problem._minimal_testset(result_table, cost, keep_slowest)
+
+
+class TestMinimalTestset:
+    def test_greedy(self):
+        result_table = [
+            (MockSubmission('a', 'WRONG_ANSWER'), results({1, 2}, durations={2: 0.5})),
+            (MockSubmission('b', 'TIME_LIMIT_EXCEEDED'), results({2, 3})),
+            (MockSubmission('c', 'RUN_TIME_ERROR'), results({3})),
+            (MockSubmission('d', 'ACCEPTED'), results(set())),
+        ]
+        # secret/3 fails most submissions, after which only a is left, which secret/1 fails faster.
+        assert minimal_testset(result_table) == (['secret/1', 'secret/3'], 3)
+
+    def test_already_covered(self):
+        result_table = [
+            (MockSubmission('a', 'WRONG_ANSWER'), results({1, 2})),
+            (MockSubmission('b', 'WRONG_ANSWER'), results({2, 3})),
+            (MockSubmission('c', 'WRONG_ANSWER'), results({2})),
+        ]
+        assert minimal_testset(result_table) == (['secret/2'], 3)
+
+    def test_ties(self):
+        # Ties in the number of failed submissions go to the fastest testcase, then by name.
+        slow_first = [(MockSubmission('a', 'WRONG_ANSWER'), results({1, 2}, durations={1: 0.5}))]
+        assert minimal_testset(slow_first) == (['secret/2'], 1)
+        same_speed = [(MockSubmission('a', 'WRONG_ANSWER'), results({1, 2}))]
+        assert minimal_testset(same_speed) == (['secret/1'], 1)
+
+    def test_keep_slowest(self):
+        result_table = [
+            (MockSubmission('a', 'WRONG_ANSWER'), results({1})),
+            (MockSubmission('b', 'ACCEPTED'), results(set(), durations={4: 0.5})),
+        ]
+        assert minimal_testset(result_table) == (['secret/1'], 1)
+        assert minimal_testset(result_table, keep_slowest=True) == (['secret/1', 'secret/4'], 1)
+
+    def test_not_failing(self):
+        result_table = [
+            (MockSubmission('a', 'WRONG_ANSWER'), results({1})),
+            (MockSubmission('b', 'WRONG_ANSWER'), results(set())),
+        ]
+        assert minimal_testset(result_table) == (['secret/1'], 1)
+
+
+class MockProblem:
+    def __init__(self, workspace):
+        self.workspace = workspace
+
+
+class MockTestcase:
+    def __init__(self, tmp_path, name, size):
+        self.name = name
+        self.short_path = Path(name + '.in')
+        self.in_path = tmp_path / 'data' / self.short_path
+        self.in_path.parent.mkdir(parents=True, exist_ok=True)
+        self.in_path.write_text('x' * size)
+
+
+class TestQuick:
+    @pytest.fixture(autouse=True)
+    def args(self):
+        old_args = config.args
+        config.args = argparse.Namespace(quick=2, seed=0, verbose=0)
+        yield config.args
+        config.args = old_args
+
+    def quick(self, tmp_path, history=dict()):
+        workspace = tmp_path / 'workspace'
+        for submission, verdicts in history.items():
+            path = workspace / 'runs' / submission / '.history.json'
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(
+                json.dumps({name: {'verdict': v, 'duration': 0.1} for name, v in verdicts.items()}))
+        # Many testcases of the same size, so that the seed decides which are selected.
+        testcases = [MockTestcase(tmp_path, 'sample/1', 1)]
+        testcases += [MockTestcase(tmp_path, f'secret/{i:02}', 10) for i in range(20)]
+        testcases.append(MockTestcase(tmp_path, 'secret/large', 100))
+        selected = problem.Problem._quick_testcases(MockProblem(workspace), testcases)
+        return [t.name for t in selected]
+
+    def test_seed(self, tmp_path, args):
+        selected = self.quick(tmp_path)
+        assert self.quick(tmp_path) == selected
+        # Samples are always kept, and the largest input is preferred.
+        assert selected[0] == 'sample/1' and 'secret/large' in selected
+        assert len(selected) == 3
+        # Other seeds choose other testcases of the same size.
+        choices = set()
+        for args.seed in range(10):
+            choices.update(self.quick(tmp_path))
+        assert len(choices) > 3
+
+    def test_failing_first(self, tmp_path, args):
+        history = {
+            'wrong_answer/a.py': {
+                'secret/05': 'WRONG_ANSWER',
+                'secret/07': 'WRONG_ANSWER',
+                'secret/large': 'ACCEPTED'
+            },
+            'time_limit_exceeded/b.py': {
+                'secret/07': 'TIME_LIMIT_EXCEEDED'
+            },
+        }
+        assert self.quick(tmp_path, history) == ['sample/1', 'secret/05', 'secret/07']
+        # secret/07 failed both submissions, so it has the highest score.
+        args.quick = 1
+        assert self.quick(tmp_path, history) == ['sample/1', 'secret/07']
+        # Testcases that never failed follow, largest input first.
+        args.quick = 3
+        assert self.quick(tmp_path, history) == [
+            'sample/1', 'secret/05', 'secret/07', 'secret/large'
+        ]
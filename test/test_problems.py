@@ -2,11 +2,13 @@ import pytest
 import yaml
 import os
 import io
+import json
 from pathlib import Path
 
 import tools
 import problem
 import config
+import util
 
 DOMJUDGE_PROBLEMS = ['hello', 'fltcmp', 'boolfind']
 IDENTITY_PROBLEMS = ['identity']
@@ -52,6 +54,36 @@ class TestIdentityProblem:
         # pass submissions + testcases
         tools.test(['run', 'data/sample/1.in', 'submissions/accepted/author.cpp'])
         tools.test(['run', 'submissions/accepted/author.c', 'submissions/accepted/author.cpp', '--samples'])
+        # parallel and serial runs
+        tools.test(['run', '--jobs', '1'])
+        tools.test(['run', '--jobs', '4'])
+        # the second run replays cached results
+        tools.test(['run', '--cached'])
+        tools.test(['run', '--cached'])
+        tools.test(['run', '--repeat', '2', '--repeat-stat', 'max'])
+        tools.test(['run', '--pipe'])
+        tools.test(['run', '--pipe', '-e'])
+        tools.test(['run', '--output-limit', '16'])
+        tools.test(['run', '--memory', '2048'])
+        tools.test(['run', '--fast-tle'])
+    def test_quick(self):
+        tools.test(['run', '--quick', '1'])
+        tools.test(['run', '--quick', '2', '--seed', '3'])
+    def test_table(self):
+        tools.test(['run', '--table'])
+        tools.test(['run', '--table-only'])
+        tools.test(['run', '--table-only', '--minimal-testset', '--keep-slowest'])
+    def test_history(self):
+        tools.test(['run'])
+        tools.test(['history'])
+    def test_timelimit(self):
+        tools.test(['timelimit'])
+    def test_diffrun(self):
+        tools.test(['diffrun', 'submissions/accepted/author.c', 'submissions/accepted/author.cpp'])
+    def test_deterministic(self):
+        tools.test(['deterministic', 'submissions/accepted/author.cpp', '--runs', '2'])
+    def test_calibrate(self):
+        tools.test(['calibrate', 'c', 'python3'])
     def test_test(self):
         tools.test(['test', 'submissions/accepted/author.c'])
         tools.test(['test', 'submissions/accepted/author.c', '--samples'])
@@ -90,6 +122,7 @@ class TestIdentityProblem:
         tools.test(['sort', '--contest', str(Path.cwd().parent)])
     def test_tmp(self):
         tools.test(['tmp'])
+        tools.test(['tmp', '--usage'])
 
     @pytest.mark.parametrize( 'bad_submission', Path(RUN_DIR/'test/problems/identity/submissions').glob('*/*.bad.*'))
     def test_bad_submission(self, bad_submission):
@@ -158,3 +191,77 @@ class TestReadProblemConfig:
         assert p.settings.validation == 'custom'
         assert p.settings.timelimit == 3.0
 
+
+
+# A small problem with bash submissions and output validator, and two test groups: the testcases
+# in secret/break are skipped once one is rejected, those in secret/continue are not.
+GROUPS_PROBLEM = {
+    'problem.yaml': 'name: groups\nvalidation: custom\n',
+    'domjudge-problem.ini': "probid='A'\ntimelimit='1'\n",
+    'data/sample/1.in': '1\n',
+    'data/sample/1.ans': '2\n',
+    'data/secret/continue/testdata.yaml': 'on_reject: continue\n',
+    'output_validators/check/check.sh': '[ "$(cat)" = "$(cat $2)" ] && exit 42 || exit 43\n',
+    'submissions/accepted/double.sh': 'read n\necho $((2 * n))\n',
+    'submissions/wrong_answer/wrong.sh': 'read n\n[ $n = 1 ] && echo 2 || echo 0\n',
+}
+# All testcases differ, since results are cached by the contents of the testcase.
+for g, group in enumerate(['break', 'continue']):
+    for i in range(1, 4):
+        GROUPS_PROBLEM[f'data/secret/{group}/{i}.in'] = f'{10 * g + i + 1}\n'
+        GROUPS_PROBLEM[f'data/secret/{group}/{i}.ans'] = f'{2 * (10 * g + i + 1)}\n'
+
+@pytest.fixture(scope='function')
+def groups_problem(tmp_path):
+    problem_dir = tmp_path / 'groups'
+    for name, content in GROUPS_PROBLEM.items():
+        (problem_dir / name).parent.mkdir(parents=True, exist_ok=True)
+        (problem_dir / name).write_text(content)
+    os.chdir(problem_dir)
+    # An earlier test that failed may have left its progress bar open.
+    util.ProgressBar.current_bar = None
+    yield problem_dir
+    tools.test(['tmp', '--clean'])
+    os.chdir(RUN_DIR)
+
+# Run bt run with the given arguments and return the run records of its --report.
+def run_report(problem_dir, *args):
+    report = problem_dir.parent / 'report.jsonl'
+    tools.test(['run', '--report', str(report), *args])
+    records = [json.loads(line) for line in report.read_text().splitlines()]
+    return {r['testcase']: r for r in records if r['type'] == 'run'}
+
+def append(path, text):
+    path.write_text(path.read_text() + text)
+
+# Changes to the groups problem, the extra arguments of the next run, and the testcases for which
+# a cached result may not be replayed after the change. None means all testcases.
+CACHE_CHANGES = {
+    'submission': (lambda p: append(p / 'submissions/accepted/double.sh', '# v2\n'), [], None),
+    'input': (lambda p: append(p / 'data/secret/break/2.in', '\n'), [], ['secret/break/2']),
+    'answer': (lambda p: append(p / 'data/secret/continue/3.ans', '\n'), [], ['secret/continue/3']),
+    'timeout': (lambda p: None, ['--timeout', '5'], None),
+    'validator': (lambda p: append(p / 'output_validators/check/check.sh', '# v2\n'), [], None),
+}
+
+class TestGroupsProblem:
+    def test_on_reject(self, groups_problem):
+        runs = run_report(groups_problem, 'submissions/wrong_answer/wrong.sh')
+        assert sorted(runs) == ['sample/1', 'secret/break/1', 'secret/continue/1',
+                                'secret/continue/2', 'secret/continue/3']
+        assert all(r['verdict'] == 'WRONG_ANSWER' for t, r in runs.items() if t != 'sample/1')
+
+    def test_cached(self, groups_problem):
+        runs = run_report(groups_problem, '--cached', 'submissions/accepted/double.sh')
+        assert len(runs) == 7 and not any(r['cached'] for r in runs.values())
+        cached_runs = run_report(groups_problem, '--cached', 'submissions/accepted/double.sh')
+        assert sorted(cached_runs) == sorted(runs)
+        assert all(r['cached'] and r['verdict'] == 'ACCEPTED' for r in cached_runs.values())
+
+    @pytest.mark.parametrize('change', CACHE_CHANGES)
+    def test_cache_key(self, groups_problem, change):
+        change, args, rerun = CACHE_CHANGES[change]
+        runs = run_report(groups_problem, '--cached', 'submissions/accepted/double.sh')
+        change(groups_problem)
+        runs = run_report(groups_problem, '--cached', *args, 'submissions/accepted/double.sh')
+        assert sorted(t for t, r in runs.items() if not r['cached']) == (rerun or sorted(runs))
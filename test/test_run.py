@@ -0,0 +1,204 @@
+import argparse
+import signal
+import threading
+import time
+import pytest
+from pathlib import Path
+
+import config
+import run
+import util
+
+
+class MockSettings:
+    def __init__(self, timelimit):
+        self.timelimit = timelimit
+        self.timeout = int(1.5 * timelimit + 1)
+        self.memory_limit = None
+        self.output_limit = None
+
+
+class MockProblem:
+    def __init__(self, timelimit=2):
+        self.path = Path('.')
+        self.settings = MockSettings(timelimit)
+
+
+class MockTestcase:
+    def __init__(self, name):
+        self.name = name
+
+
+def mock_submission(problem, expected_verdicts):
+    submission = run.Submission.__new__(run.Submission)
+    submission.problem = problem
+    submission.expected_verdicts = expected_verdicts
+    return submission
+
+
+@pytest.fixture(autouse=True)
+def args():
+    old_args = config.args
+    config.args = argparse.Namespace(verbose=0,
+                                     error=False,
+                                     table=False,
+                                     fast_tle=True,
+                                     borderline=0.1)
+    yield config.args
+    config.args = old_args
+
+
+class TestFastTle:
+    def test_timeout(self, args):
+        problem = MockProblem(timelimit=2)
+        tle = mock_submission(problem, ['TIME_LIMIT_EXCEEDED'])
+        accepted = mock_submission(problem, ['ACCEPTED'])
+        assert tle.timeout() == pytest.approx(2 + config.FAST_TLE_MARGIN)
+        assert accepted.timeout() == problem.settings.timeout
+        # All runs are measured completely with -v and --table.
+        args.verbose = 1
+        assert tle.timeout() == problem.settings.timeout
+        args.verbose = 0
+        args.table = True
+        assert tle.timeout() == problem.settings.timeout
+
+    def test_killed_after_timelimit(self):
+        problem = MockProblem(timelimit=2)
+        tle = mock_submission(problem, ['TIME_LIMIT_EXCEEDED'])
+        result = util.exec_command(['sleep', '10'], timeout=tle.timeout())
+        assert result.ok is not True
+        assert problem.settings.timelimit < result.duration < problem.settings.timeout
+        assert result.wall_time < problem.settings.timeout
+
+    def test_killed_runs_are_not_borderline(self):
+        problem = MockProblem(timelimit=2)
+        tle = mock_submission(problem, ['TIME_LIMIT_EXCEEDED'])
+        r = run.Run(problem, tle, MockTestcase('secret/1'))
+        killed = util.ExecResult(-9, tle.timeout(), None, None, 'TIME_LIMIT_EXCEEDED')
+        assert not r._is_borderline(killed)
+        accepted = mock_submission(problem, ['ACCEPTED'])
+        r = run.Run(problem, accepted, MockTestcase('secret/1'))
+        slow = util.ExecResult(True, 2.1, None, None, 'TIME_LIMIT_EXCEEDED')
+        assert r._is_borderline(slow)
+
+
+class TestCancellation:
+    def test_reaped_without_rusage(self):
+        process = util.ResourcePopen(['true'])
+        time.sleep(0.2)
+        # Popen.kill() reaps the process that already exited, without storing its rusage.
+        process.kill()
+        process.communicate()
+        assert util._duration(process, True, 1.0) == 1.0
+
+    def test_kill_process_keeps_rusage(self):
+        process = util.ResourcePopen(['true'])
+        time.sleep(0.2)
+        util.kill_process(process)
+        process.communicate()
+        assert process.rusage is not None
+
+    # Cancel the run around the moment its timeout expires.
+    @pytest.mark.parametrize('delay', [0.25, 0.29, 0.3, 0.31, 0.35])
+    def test_cancel_during_timeout(self, delay):
+        cancellation = util.Cancellation()
+        timer = threading.Timer(delay, cancellation.cancel)
+        timer.start()
+        result = util.exec_command(['sleep', '10'], timeout=0.3, cancellation=cancellation)
+        timer.join()
+        assert result.ok is not True
+        assert result.duration < 5
+
+
+@pytest.mark.skipif(not util.MemoryWatchdog.supported(), reason='needs /proc')
+class TestMemory:
+    def test_inherited_memory_is_not_counted(self):
+        ballast = bytearray(300 * 2**20)
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+        result = util.exec_command(['sleep', '0.2'], watch_memory=True, memory=16)
+        assert result.ok is True
+        assert result.memory is None or result.memory < 16 * 2**20
+
+    def test_memory_limit(self):
+        allocate = 'x = bytearray(100 * 2**20)\nfor i in range(0, len(x), 4096): x[i] = 1\n'
+        allocate += 'import time\ntime.sleep(1)\n'
+        result = util.exec_command(['python3', '-c', allocate], watch_memory=True, memory=50)
+        assert result.ok is not True
+        assert result.memory > 50 * 2**20
+
+
+class MockPool:
+    def __init__(self):
+        self.tasks = []
+
+    def put(self, task, group=None):
+        self.tasks.append(task)
+
+
+class TestRunQueue:
+    def test_window(self):
+        problem = MockProblem()
+        testcases = [MockTestcase(f'secret/{i}') for i in range(10)]
+        submissions = [mock_submission(problem, ['ACCEPTED']) for _ in range(2)]
+        for submission in submissions:
+            submission.ordered_testcases = lambda: testcases
+            submission.cancelled = lambda: False
+        pool = MockPool()
+        queue = run.RunQueue(pool, submissions, 3)
+        assert len(pool.tasks) == 3
+        for testcase in testcases:
+            assert queue.next(submissions[0]).testcase is testcase
+            assert len(pool.tasks) <= 3 + testcases.index(testcase) + 1
+        # The runs of the second submission are queued before the first one is done.
+        assert len(pool.tasks) == 13
+        assert queue.next(submissions[1]).testcase is testcases[0]
+
+
+class TestTestcase:
+    def test_name(self):
+        testcase = run.Testcase(MockProblem(), Path('1.in'), short_path=Path('secret/abcdef.in'))
+        assert testcase.name == 'secret/abcdef'
+
+
+class TestOutputLimit:
+    # CPython ignores SIGXFSZ and exits with an error on EFBIG instead.
+    def test_python_exceeds_output_limit(self, tmp_path):
+        out_path = tmp_path / 'out'
+        with out_path.open('wb') as out:
+            result = util.exec_command(['python3', '-c', 'print("x" * 2**21)'],
+                                       stdout=out,
+                                       output_limit=1)
+        assert result.ok is not True and result.ok != -signal.SIGXFSZ
+        assert util.exceeds_output_limit(result, out_path, 1)
+        assert not util.exceeds_output_limit(result, out_path, 4)
+
+
+class TestPipe:
+    # The validator rejects the first line and exits before the submission finishes.
+    validator = ['python3', '-c', 'import sys; sys.stdin.readline(); sys.exit(43)']
+
+    def pipe(self, command, tmp_path):
+        with open('/dev/null') as stdin:
+            result, validator_result = util.exec_pipeline(command,
+                                                          self.validator,
+                                                          stdin=stdin,
+                                                          cwd=tmp_path,
+                                                          validator_cwd=tmp_path,
+                                                          timeout=5,
+                                                          validator_expect=42)
+        assert validator_result.ok == 43
+        return result
+
+    def test_crash_after_wrong_answer(self, tmp_path):
+        crash = 'import sys, time; print("wrong", flush=True); time.sleep(0.5); sys.exit(3)'
+        command = ['python3', '-c', crash]
+        assert self.pipe(command, tmp_path).ok == 3
+        assert util.exec_command(command, timeout=5).ok == 3
+
+    def test_sigpipe_is_not_a_crash(self, tmp_path):
+        assert self.pipe(['yes'], tmp_path).ok is True
+
+    def test_epipe_is_not_a_crash(self, tmp_path):
+        command = ['python3', '-c', 'while True: print("wrong " * 1000)']
+        assert self.pipe(command, tmp_path).ok is True